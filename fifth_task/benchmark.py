@@ -0,0 +1,234 @@
+"""
+Замеры скорости трассировщика.
+
+    python benchmark.py -o bench.json
+    python benchmark.py --quick -o new.json --compare bench.json
+    python benchmark.py --check-workers 4
+
+Сцены: демонстрационная сцена окна (build_scene) и синтетические сцены
+из случайных треугольников и шаров с разным числом фигур и источников света.
+Каждая сцена рендерится в нескольких разрешениях; для каждого прогона
+записываются лучи в секунду, проверки пересечений на луч (по счётчикам
+instrumentation, собранным отдельным прогоном) и пиковая память
+трассировки. Результат пишется в JSON, который можно сравнить с прошлым
+прогоном (--compare): замедление больше допуска даёт код выхода 1.
+--check-workers N вместо замеров проверяет, что кадр с выборкой источников
+(light_samples) при N процессах совпадает с однопроцессным.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from instrumentation import stats
+from tracer import Point, Sphere, Side, TetrahedronSide, Light, Tracer, build_scene, demo_objects, \
+    green, red, white, yellow, blue, gray
+
+PRIMITIVES = [10, 100, 1000, 10000, 100000]
+LIGHTS = [1, 4, 16, 64]
+RESOLUTIONS = [32, 64, 128]
+QUICK_PRIMITIVES = [10, 100, 1000]
+QUICK_LIGHTS = [1, 8]
+QUICK_RESOLUTIONS = [32, 64]
+
+# фиксированная сцена для развёртки по числу источников и источники для развёртки по числу фигур
+LIGHT_SWEEP_PRIMITIVES = 1000
+PRIMITIVE_SWEEP_LIGHTS = 1
+
+
+def synthetic_scene(primitives: int, lights: int, seed: int = 0) -> (list, list):
+    """ задняя стена и primitives - 1 случайных треугольников и шаров (каждый десятый - шар) перед ней """
+    rng = np.random.default_rng(seed)
+    materials = [red, white, yellow, blue, gray]
+    size = 0.8 / np.sqrt(primitives)
+
+    shapes = [Side([Point(1, 1, 3), Point(-1, 1, 3), Point(-1, -1, 3), Point(1, -1, 3)],
+                   material=gray, norm=Point(0, 0, -1))]
+    centers = rng.uniform([-0.45, -0.45, 1.2], [0.45, 0.45, 2.9], (primitives - 1, 3))
+    for number, center in enumerate(centers):
+        if number % 10 == 9:
+            material = green if number % 20 == 19 else materials[number % len(materials)]
+            shapes.append(Sphere(Point(*center), size / 2, material))
+        else:
+            corners = center + rng.normal(0, size, (3, 3))
+            shapes.append(TetrahedronSide([Point(*corner) for corner in corners], materials[number % len(materials)]))
+
+    positions = rng.uniform([-0.45, -0.45, 0.2], [0.45, 0.45, 1.0], (lights, 3))
+    scene_lights = [Light(intensity=0.8 / lights, position=Point(*position)) for position in positions]
+    return shapes, scene_lights
+
+
+def shape_tests(counters: dict) -> dict:
+    """ проверки пересечения луча с фигурой по типам фигур """
+    return {name[len('tests.'):]: count for name, count in counters.items()
+            if name.startswith('tests.') and name != 'tests.triangles'}
+
+
+def run_case(tracer: Tracer, width: int, height: int, repeat: int, memory: bool) -> dict:
+    tracer.resize(width, height)
+    tracer.directions  # сетка лучей строится один раз на разрешение и в замер не входит
+
+    # время меряется без счётчиков, счётчики собираются отдельным прогоном
+    seconds = np.inf
+    for _ in range(repeat):
+        tracer.reset()
+        started = time.perf_counter()
+        tracer.trace()
+        seconds = min(seconds, time.perf_counter() - started)
+
+    stats.reset()
+    stats.enable()
+    try:
+        tracer.trace()
+    finally:
+        stats.disable()
+    counters = stats.as_dict()['counters']
+
+    shadow_rays = counters.get('rays.shadow', 0)
+    rays = counters.get('rays.primary', 0) + counters.get('rays.refraction', 0) + shadow_rays
+    by_shape = shape_tests(counters)
+    tests = sum(by_shape.values())
+    result = {
+        'width': width,
+        'height': height,
+        'seconds': seconds,
+        'primary_rays': counters.get('rays.primary', 0),
+        'refraction_rays': counters.get('rays.refraction', 0),
+        'shadow_rays': shadow_rays,
+        'rays': rays,
+        'rays_per_second': rays / seconds if seconds else 0.,
+        'intersection_tests': tests,
+        'tests_per_ray': tests / rays if rays else 0.,
+        'tests_by_shape': by_shape,
+        'triangle_tests': counters.get('tests.triangles', 0),
+        'bvh_node_visits': counters.get('bvh.node_visits', 0),
+    }
+
+    if memory:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        tracer.trace()
+        result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return result
+
+
+def cases(quick: bool):
+    """ (имя сцены, число фигур, число источников, построитель сцены) для всех развёрток """
+    primitives = QUICK_PRIMITIVES if quick else PRIMITIVES
+    lights = QUICK_LIGHTS if quick else LIGHTS
+
+    yield 'demo', None, None, lambda: build_scene(*demo_objects())
+    for count in primitives:
+        yield 'primitives', count, PRIMITIVE_SWEEP_LIGHTS, \
+            lambda count=count: synthetic_scene(count, PRIMITIVE_SWEEP_LIGHTS)
+    for count in lights:
+        yield 'lights', LIGHT_SWEEP_PRIMITIVES, count, \
+            lambda count=count: synthetic_scene(LIGHT_SWEEP_PRIMITIVES, count)
+
+
+def workers_check(workers: int, size: int = 48) -> int:
+    """ наибольшее расхождение (0-255) кадров с выборкой источников при одном процессе и при workers """
+    shapes, scene_lights = synthetic_scene(100, 16)
+    frames = []
+    for count in (1, workers):
+        tracer = Tracer(camera=Point(0, 0, 0), shapes=shapes, lights=scene_lights, width=size, height=size)
+        tracer.light_samples = 4
+        frames.append(tracer.trace(workers=count, tile_size=16).astype(int))
+    return int(np.abs(frames[0] - frames[1]).max())
+
+
+def run(resolutions: list, quick: bool, repeat: int, memory: bool) -> list:
+    results = []
+    for name, primitives, lights, build in cases(quick):
+        shapes, scene_lights = build()
+        tracer = Tracer(camera=Point(0, 0, 0), shapes=shapes, lights=scene_lights)
+        started = time.perf_counter()
+        tracer.bvh
+        build_seconds = time.perf_counter() - started
+
+        for resolution in resolutions:
+            result = {
+                'scene': name,
+                'primitives': len(shapes),
+                'lights': len(scene_lights),
+                'bvh_build_seconds': build_seconds,
+            }
+            result.update(run_case(tracer, resolution, resolution, repeat, memory))
+            results.append(result)
+            print('{scene:>10} {primitives:>7} prims {lights:>3} lights {width:>4}x{height:<4} '
+                  '{rays_per_second:>12.0f} rays/s {tests_per_ray:>8.2f} tests/ray'.format(**result),
+                  file=sys.stderr)
+    return results
+
+
+def case_key(result: dict) -> tuple:
+    return result['scene'], result['primitives'], result['lights'], result['width'], result['height']
+
+
+def compare(results: list, baseline: list, tolerance: float) -> bool:
+    """ сравнение с прошлым прогоном; True, если нигде нет замедления больше tolerance """
+    previous = {case_key(result): result for result in baseline}
+    ok = True
+    for result in results:
+        old = previous.get(case_key(result))
+        if old is None or not old['rays_per_second']:
+            continue
+        ratio = result['rays_per_second'] / old['rays_per_second']
+        regression = ratio < 1 - tolerance
+        ok = ok and not regression
+        print('{:>10} {:>7} prims {:>3} lights {:>4}x{:<4} {:>7.2f}x{}'.format(
+            *case_key(result), ratio, '  REGRESSION' if regression else ''), file=sys.stderr)
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the global_illumination tracer.')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='JSON file for the results')
+    parser.add_argument('-r', '--resolutions', type=int, nargs='+', help='square frame sizes')
+    parser.add_argument('--quick', action='store_true', help='smaller sweeps for a fast check')
+    parser.add_argument('--repeat', type=int, default=1, help='timed runs per case, the best one is kept')
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory pass')
+    parser.add_argument('--compare', help='previous results to compare rays/s against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed slowdown for --compare')
+    parser.add_argument('--check-workers', type=int, metavar='N',
+                        help='only check that N processes render a sampled-light frame like one process')
+    args = parser.parse_args(argv)
+
+    if args.check_workers:
+        difference = workers_check(args.check_workers)
+        print('1 vs {} workers: max difference {}/255'.format(args.check_workers, difference), file=sys.stderr)
+        if difference:
+            sys.exit(1)
+        return
+
+    resolutions = args.resolutions or (QUICK_RESOLUTIONS if args.quick else RESOLUTIONS)
+    results = run(resolutions, args.quick, args.repeat, not args.no_memory)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+import numpy as np
+
+from instrumentation import stats
+
+# Небольшое расширение коробок, чтобы ошибки округления не отсекали касательные попадания
+PAD = 1e-6
+
+
+def surface_area(lower: np.ndarray, upper: np.ndarray) -> np.ndarray:
+    d = upper - lower
+    return 2 * (d[..., 0] * d[..., 1] + d[..., 1] * d[..., 2] + d[..., 2] * d[..., 0])
+
+
+def safe_inverse(directions: np.ndarray) -> np.ndarray:
+    """ обратные направления без деления на ноль (для slab-теста) """
+    return 1. / np.where(directions == 0, 1e-30, directions)
+
+
+class BVH:
+    """
+    Иерархия ограничивающих объёмов над объектами, заданными своими AABB.
+    Строится один раз с разбиением по бинам с оценкой SAH.
+    Объекты с бесконечными границами в дерево не попадают и проверяются всегда.
+    Сами объекты BVH не знает: пересечение с объектом по его номеру считает
+    переданная в запрос функция.
+    """
+    ARRAYS = ('items', 'lower', 'upper', 'left', 'right', 'start', 'count', 'axis')
+
+    def __init__(self, lower: np.ndarray, upper: np.ndarray, leaf_size: int = 4, bins: int = 12):
+        lower = np.asarray(lower, dtype=float).reshape(-1, 3)
+        upper = np.asarray(upper, dtype=float).reshape(-1, 3)
+        finite = np.isfinite(lower).all(axis=1) & np.isfinite(upper).all(axis=1)
+
+        self.leaf_size = leaf_size
+        self.bins = bins
+        self.unbounded: list = np.flatnonzero(~finite).tolist()
+        self.items: np.ndarray = np.flatnonzero(finite)
+
+        self.lower = np.empty((0, 3))
+        self.upper = np.empty((0, 3))
+        self.left = np.empty(0, dtype=int)
+        self.right = np.empty(0, dtype=int)
+        self.start = np.empty(0, dtype=int)
+        self.count = np.empty(0, dtype=int)
+        self.axis = np.empty(0, dtype=int)
+
+        if self.items.size:
+            self.build(lower - PAD, upper + PAD)
+
+        self._nodes: list = None
+        self._item_list: list = None
+
+    def __len__(self):
+        return len(self.lower)
+
+    def to_arrays(self) -> dict:
+        """ дерево как словарь массивов (для np.savez); обратно - from_arrays """
+        arrays = {name: getattr(self, name) for name in self.ARRAYS}
+        arrays['unbounded'] = np.array(self.unbounded, dtype=int)
+        arrays['settings'] = np.array([self.leaf_size, self.bins])
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays) -> 'BVH':
+        bvh = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(bvh, name, np.asarray(arrays[name]))
+        bvh.unbounded = np.asarray(arrays['unbounded']).tolist()
+        bvh.leaf_size, bvh.bins = np.asarray(arrays['settings']).tolist()
+        bvh._nodes = None
+        bvh._item_list = None
+        return bvh
+
+    @property
+    def nodes(self) -> list:
+        """ копия узлов в обычных списках для поточечного обхода без накладных расходов numpy """
+        if self._nodes is None:
+            self._nodes = list(zip(self.lower.tolist(), self.upper.tolist(), self.left.tolist(),
+                                   self.right.tolist(), self.start.tolist(), self.count.tolist(), self.axis.tolist()))
+        return self._nodes
+
+    @property
+    def item_list(self) -> list:
+        if self._item_list is None:
+            self._item_list = self.items.tolist()
+        return self._item_list
+
+    def build(self, lower: np.ndarray, upper: np.ndarray):
+        centroids = (lower + upper) / 2
+        node_lower, node_upper, left, right, start, count, axes = [], [], [], [], [], [], []
+
+        def new_node(first, last):
+            node_lower.append(None)
+            node_upper.append(None)
+            left.append(-1)
+            right.append(-1)
+            start.append(first)
+            count.append(last - first)
+            axes.append(0)
+            return len(left) - 1
+
+        stack = [new_node(0, len(self.items))]
+        while stack:
+            node = stack.pop()
+            first, last = start[node], start[node] + count[node]
+            items = self.items[first:last]
+            node_lower[node] = lower[items].min(axis=0)
+            node_upper[node] = upper[items].max(axis=0)
+
+            if last - first <= self.leaf_size:
+                continue
+
+            split = self.find_split(items, lower, upper, centroids, node_lower[node], node_upper[node])
+            if split is None:
+                continue
+            axis, on_left = split
+
+            self.items[first:last] = np.concatenate((items[on_left], items[~on_left]))
+            middle = first + int(on_left.sum())
+            left[node] = new_node(first, middle)
+            right[node] = new_node(middle, last)
+            axes[node] = axis
+            count[node] = 0
+            stack.append(right[node])
+            stack.append(left[node])
+
+        self.lower = np.array(node_lower)
+        self.upper = np.array(node_upper)
+        self.left = np.array(left)
+        self.right = np.array(right)
+        self.start = np.array(start)
+        self.count = np.array(count)
+        self.axis = np.array(axes)
+
+    def find_split(self, items, lower, upper, centroids, box_lower, box_upper):
+        """ лучшее разбиение по бинам центроидов; None, если выгоднее оставить лист """
+        c = centroids[items]
+        c_min, c_max = c.min(axis=0), c.max(axis=0)
+        extent = c_max - c_min
+        n = len(items)
+        area = max(surface_area(box_lower, box_upper), 1e-30)
+
+        best_cost, best = np.inf, None
+        for axis in range(3):
+            if extent[axis] <= 0:
+                continue
+            bins = np.minimum(((c[:, axis] - c_min[axis]) / extent[axis] * self.bins).astype(int), self.bins - 1)
+            counts = np.bincount(bins, minlength=self.bins)
+            bin_lower = np.full((self.bins, 3), np.inf)
+            bin_upper = np.full((self.bins, 3), -np.inf)
+            np.minimum.at(bin_lower, bins, lower[items])
+            np.maximum.at(bin_upper, bins, upper[items])
+
+            left_count = np.cumsum(counts)[:-1]
+            right_count = n - left_count
+            left_area = surface_area(np.minimum.accumulate(bin_lower)[:-1], np.maximum.accumulate(bin_upper)[:-1])
+            right_area = surface_area(np.minimum.accumulate(bin_lower[::-1])[::-1][1:],
+                                      np.maximum.accumulate(bin_upper[::-1])[::-1][1:])
+            valid = (left_count > 0) & (right_count > 0)
+            if not valid.any():
+                continue
+            cost = np.where(valid, 1 + (left_area * left_count + right_area * right_count) / area, np.inf)
+            split = int(np.argmin(cost))
+            if cost[split] < best_cost:
+                best_cost, best = cost[split], (axis, bins <= split)
+
+        if best is None:
+            # центроиды совпадают: делим пополам, чтобы листья не разрастались
+            if n <= 4 * self.leaf_size:
+                return None
+            axis = int(np.argmax(box_upper - box_lower))
+            on_left = np.zeros(n, dtype=bool)
+            on_left[np.argsort(c[:, axis], kind='stable')[:n // 2]] = True
+            return axis, on_left
+        if best_cost >= n and n <= 4 * self.leaf_size:
+            return None
+        return best
+
+    # --- поточечные запросы ---
+
+    def slab(self, node, origin, inverse):
+        lower, upper = node[0], node[1]
+        near, far = -np.inf, np.inf
+        for k in range(3):
+            t1 = (lower[k] - origin[k]) * inverse[k]
+            t2 = (upper[k] - origin[k]) * inverse[k]
+            if t1 > t2:
+                t1, t2 = t2, t1
+            if t1 > near:
+                near = t1
+            if t2 < far:
+                far = t2
+        return near, far
+
+    def closest(self, origin, direction, intersect, min_dist: float, max_dist: float) -> (int, float):
+        """
+        Ближайшее пересечение одного луча: intersect(item) -> расстояние или np.inf.
+        При равных расстояниях выигрывает объект с меньшим номером, как при линейном переборе.
+        """
+        best_item, best_t = -1, np.inf
+        limit = max_dist
+
+        def consider(item):
+            nonlocal best_item, best_t
+            t = intersect(item)
+            if t < min_dist or t > limit:
+                return
+            if t < best_t or (t == best_t and item < best_item):
+                best_item, best_t = item, t
+
+        for item in self.unbounded:
+            consider(item)
+
+        nodes, item_list = self.nodes, self.item_list
+        if nodes:
+            inverse = [1. / d if d != 0 else 1e30 for d in direction]
+            stack = [0]
+            visits = 0
+            while stack:
+                node = nodes[stack.pop()]
+                visits += 1
+                near, far = self.slab(node, origin, inverse)
+                if near > far or far < min_dist or near > limit or near > best_t:
+                    continue
+                if node[5]:
+                    for item in item_list[node[4]:node[4] + node[5]]:
+                        consider(item)
+                elif inverse[node[6]] > 0:
+                    stack.append(node[3])
+                    stack.append(node[2])
+                else:
+                    stack.append(node[2])
+                    stack.append(node[3])
+            if stats.enabled:
+                stats.count('bvh.node_visits', visits)
+
+        return best_item, best_t
+
+    def any_hit(self, origin, direction, intersect, min_dist: float, max_dist: float) -> bool:
+        """ есть ли хоть одно пересечение на отрезке луча; обход прекращается на первом же """
+        for item in self.unbounded:
+            if min_dist <= intersect(item) <= max_dist:
+                return True
+
+        nodes, item_list = self.nodes, self.item_list
+        if nodes:
+            inverse = [1. / d if d != 0 else 1e30 for d in direction]
+            stack = [0]
+            visits = 0
+            try:
+                while stack:
+                    node = nodes[stack.pop()]
+                    visits += 1
+                    near, far = self.slab(node, origin, inverse)
+                    if near > far or far < min_dist or near > max_dist:
+                        continue
+                    if node[5]:
+                        for item in item_list[node[4]:node[4] + node[5]]:
+                            if min_dist <= intersect(item) <= max_dist:
+                                return True
+                    else:
+                        stack.append(node[3])
+                        stack.append(node[2])
+            finally:
+                if stats.enabled:
+                    stats.count('bvh.node_visits', visits)
+
+        return False
+
+    # --- пакетные запросы ---
+
+    def slabs(self, node: int, origins: np.ndarray, inverse: np.ndarray) -> (np.ndarray, np.ndarray):
+        t1 = (self.lower[node] - origins) * inverse
+        t2 = (self.upper[node] - origins) * inverse
+        return np.minimum(t1, t2).max(axis=1), np.maximum(t1, t2).min(axis=1)
+
+    def closest_batch(self, origins: np.ndarray, directions: np.ndarray, intersect, min_dist: float,
+                      max_dist) -> (np.ndarray, np.ndarray):
+        """
+        Ближайшие пересечения пакета лучей: intersect(item, rays) -> (расстояния, грани) для лучей rays.
+        Пакет спускается по дереву, в каждом узле оставляя только лучи, попавшие в его коробку.
+        Возвращает номера объектов (-1 при промахе), расстояния и грани.
+        """
+        count = len(directions)
+        limit = np.broadcast_to(np.asarray(max_dist, dtype=float), (count,))
+        best_item = np.full(count, -1)
+        best_t = np.full(count, np.inf)
+        best_face = np.zeros(count, dtype=int)
+
+        def consider(item, rays):
+            t, faces = intersect(item, rays)
+            closer = (t >= min_dist) & (t <= limit[rays]) & \
+                ((t < best_t[rays]) | ((t == best_t[rays]) & (item < best_item[rays])))
+            best_t[rays[closer]] = t[closer]
+            best_item[rays[closer]] = item
+            best_face[rays[closer]] = faces[closer]
+
+        every = np.arange(count)
+        for item in self.unbounded:
+            consider(item, every)
+
+        if len(self) and count:
+            inverse = safe_inverse(directions)
+            stack = [(0, every)]
+            while stack:
+                node, rays = stack.pop()
+                if stats.enabled:
+                    stats.count('bvh.node_visits', len(rays))
+                near, far = self.slabs(node, origins[rays], inverse[rays])
+                rays = rays[(near <= far) & (far >= min_dist) & (near <= limit[rays]) & (near <= best_t[rays])]
+                if not rays.size:
+                    continue
+                if self.count[node]:
+                    for item in self.items[self.start[node]:self.start[node] + self.count[node]]:
+                        consider(int(item), rays)
+                elif directions[rays, self.axis[node]].sum() > 0:
+                    stack.append((self.right[node], rays))
+                    stack.append((self.left[node], rays))
+                else:
+                    stack.append((self.left[node], rays))
+                    stack.append((self.right[node], rays))
+
+        return best_item, best_t, best_face
+
+    def any_hit_batch(self, origins: np.ndarray, directions: np.ndarray, intersect, min_dist: float,
+                      max_dist) -> np.ndarray:
+        """ маска лучей пакета, у которых есть пересечение; перекрытые лучи сразу выбывают из обхода """
+        count = len(directions)
+        limit = np.broadcast_to(np.asarray(max_dist, dtype=float), (count,))
+        blocked = np.zeros(count, dtype=bool)
+
+        def consider(item, rays):
+            rays = rays[~blocked[rays]]
+            if rays.size:
+                t = intersect(item, rays)[0]
+                blocked[rays[(t >= min_dist) & (t <= limit[rays])]] = True
+
+        every = np.arange(count)
+        for item in self.unbounded:
+            consider(item, every)
+
+        if len(self) and count:
+            inverse = safe_inverse(directions)
+            stack = [(0, every)]
+            while stack:
+                node, rays = stack.pop()
+                rays = rays[~blocked[rays]]
+                if not rays.size:
+                    continue
+                if stats.enabled:
+                    stats.count('bvh.node_visits', len(rays))
+                near, far = self.slabs(node, origins[rays], inverse[rays])
+                rays = rays[(near <= far) & (far >= min_dist) & (near <= limit[rays])]
+                if not rays.size:
+                    continue
+                if self.count[node]:
+                    for item in self.items[self.start[node]:self.start[node] + self.count[node]]:
+                        consider(int(item), rays)
+                else:
+                    stack.append((self.right[node], rays))
+                    stack.append((self.left[node], rays))
+
+        return blocked
@@ -0,0 +1,127 @@
+import struct
+import zlib
+
+import numpy as np
+
+
+class PpmStream:
+    """ построчная запись двоичного PPM (P6): строки пишутся в файл сразу, в памяти не копятся """
+
+    def __init__(self, path: str, width: int, height: int):
+        self.width, self.height = width, height
+        self.file = open(path, 'wb')
+        self.file.write(b'P6\n%d %d\n255\n' % (width, height))
+
+    def write_rows(self, rgb: np.ndarray):
+        """ очередные строки кадра (rows, width, 3) uint8 сверху вниз """
+        self.file.write(np.ascontiguousarray(rgb, dtype=np.uint8).tobytes())
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+
+class PngStream(PpmStream):
+    """ построчная запись PNG: строки сжимаются потоком и уходят в файл отдельными блоками IDAT """
+
+    def __init__(self, path: str, width: int, height: int):
+        self.width, self.height = width, height
+        self.compressor = zlib.compressobj(6)
+        self.file = open(path, 'wb')
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        self.file.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+
+    def write_rows(self, rgb: np.ndarray):
+        rows = np.empty((len(rgb), 1 + 3 * self.width), dtype=np.uint8)
+        rows[:, 0] = 0  # фильтр строки: None
+        rows[:, 1:] = np.asarray(rgb, dtype=np.uint8).reshape(len(rgb), 3 * self.width)
+        self.write_data(self.compressor.compress(rows.tobytes()))
+
+    def write_data(self, data: bytes):
+        if data:
+            self.file.write(png_chunk(b'IDAT', data))
+
+    def close(self):
+        if self.compressor is not None:
+            self.write_data(self.compressor.flush())
+            self.file.write(png_chunk(b'IEND', b''))
+            self.compressor = None
+        self.file.close()
+
+
+class NpyStream(PpmStream):
+    """ запись в отображённый в память .npy (height, width, 3) uint8: страницы сбрасываются на диск по мере записи """
+
+    def __init__(self, path: str, width: int, height: int):
+        self.width, self.height = width, height
+        self.array = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(height, width, 3))
+        self.row = 0
+
+    def write_rows(self, rgb: np.ndarray):
+        self.array[self.row:self.row + len(rgb)] = rgb
+        self.row += len(rgb)
+        self.array.flush()
+
+    def close(self):
+        if self.array is not None:
+            self.array.flush()
+            self.array = None
+
+
+STREAMS = {
+    'png': PngStream,
+    'ppm': PpmStream,
+    'npy': NpyStream,
+}
+
+
+def image_format(path: str) -> str:
+    extension = path.rsplit('.', 1)[-1].lower()
+    if extension not in STREAMS:
+        raise ValueError('Unsupported image format: {}'.format(extension))
+    return extension
+
+
+def open_image_stream(path: str, width: int, height: int) -> PpmStream:
+    """ построчная запись кадра в формате, выбранном по расширению файла """
+    return STREAMS[image_format(path)](path, width, height)
+
+
+def write_ppm(path: str, rgb: np.ndarray):
+    """ запись кадра (height, width, 3) uint8 в двоичный PPM (P6) """
+    height, width = rgb.shape[:2]
+    with PpmStream(path, width, height) as stream:
+        stream.write_rows(rgb)
+
+
+def write_png(path: str, rgb: np.ndarray):
+    """ запись кадра (height, width, 3) uint8 в PNG без сторонних библиотек """
+    height, width = rgb.shape[:2]
+    with PngStream(path, width, height) as stream:
+        stream.write_rows(rgb)
+
+
+def write_npy(path: str, rgb: np.ndarray):
+    np.save(path, np.asarray(rgb, dtype=np.uint8))
+
+
+WRITERS = {
+    'png': write_png,
+    'ppm': write_ppm,
+    'npy': write_npy,
+}
+
+
+def write_image(path: str, rgb: np.ndarray):
+    """ запись кадра в формате, выбранном по расширению файла """
+    WRITERS[image_format(path)](path, rgb)
@@ -0,0 +1,95 @@
+"""
+Счётчики и таймеры трассировщика.
+
+Горячий код обращается к общему объекту stats так:
+
+    if stats.enabled:
+        stats.count('rays.shadow', len(directions))
+
+    with stats.phase('lighting'):
+        ...
+
+Пока сбор выключен, это одна проверка флага на пакет лучей, а phase
+возвращает общий пустой контекст. Включается и выключается на ходу:
+
+    stats.enable()                # только счётчики и таймеры
+    stats.enable(profile=True)    # плюс cProfile на то же время
+    tracer.trace()
+    stats.disable()
+    stats.as_dict()               # {'counters': {...}, 'timers': {...}}
+    stats.dump_profile('trace.prof')   # для pstats, snakeviz и т.п.
+"""
+import cProfile
+import pstats
+import time
+from collections import Counter, defaultdict
+from contextlib import nullcontext
+
+NULL_PHASE = nullcontext()
+
+
+class Phase:
+    def __init__(self, owner: 'Stats', name: str):
+        self.owner = owner
+        self.name = name
+        self.started = 0.
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.owner.timers[self.name] += time.perf_counter() - self.started
+        return False
+
+
+class Stats:
+    def __init__(self):
+        self.enabled: bool = False
+        self.counters: Counter = Counter()
+        self.timers: defaultdict = defaultdict(float)
+        self.profiler: cProfile.Profile = None
+
+    def enable(self, profile: bool = False, profiler: cProfile.Profile = None):
+        """ включение сбора; profile или свой profiler запускают cProfile на время сбора """
+        self.enabled = True
+        if profile or profiler is not None:
+            self.profiler = profiler if profiler is not None else cProfile.Profile()
+            self.profiler.enable()
+
+    def disable(self):
+        self.enabled = False
+        if self.profiler is not None:
+            self.profiler.disable()
+
+    def reset(self):
+        self.counters.clear()
+        self.timers.clear()
+        self.profiler = None
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] += amount
+
+    def phase(self, name: str):
+        """ контекст, замеряющий время фазы name """
+        return Phase(self, name) if self.enabled else NULL_PHASE
+
+    def merge(self, data: dict):
+        """ добавление счётчиков и таймеров, собранных в другом процессе (см. as_dict) """
+        self.counters.update(data.get('counters', {}))
+        for name, seconds in data.get('timers', {}).items():
+            self.timers[name] += seconds
+
+    def as_dict(self) -> dict:
+        return {'counters': dict(self.counters), 'timers': dict(self.timers)}
+
+    def profile_stats(self) -> pstats.Stats:
+        if self.profiler is None:
+            raise RuntimeError('Profiling was not enabled')
+        return pstats.Stats(self.profiler)
+
+    def dump_profile(self, path: str):
+        self.profile_stats().dump_stats(path)
+
+
+stats = Stats()
@@ -0,0 +1,217 @@
+"""
+Загрузка сеток из OBJ и двоичного PLY в массивы numpy.
+
+    mesh = load_mesh('bunny.ply', material=white)
+    vertices, faces = load_mesh_arrays('scan.obj')
+
+Вершины - массив (V, 3) float64, грани - (F, 3) int64 (многоугольники
+разбиваются веером на треугольники). После первого чтения рядом с файлом
+кладутся model.obj.vertices.npy и model.obj.faces.npy (и model.obj.bvh.npz
+с деревом для трассировки); пока они не старше исходного файла, следующие
+загрузки отображают массивы в память без разбора и не строят дерево заново.
+"""
+import os
+import sys
+
+import numpy as np
+
+from bvh import BVH
+from tracer import Material, TriangleMesh
+
+PLY_TYPES = {
+    'char': 'i1', 'int8': 'i1',
+    'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2',
+    'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4',
+    'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4',
+    'double': 'f8', 'float64': 'f8',
+}
+
+# Порог вырожденности треугольника в TriangleMesh сравнивается с определителем, который
+# растёт как квадрат размера треугольника: у сканов с мелкими гранями обычный 0.0001
+# отбросил бы почти все треугольники. От самопересечений защищает min_dist трассировщика.
+MESH_EPS = 1e-12
+
+
+def fan_triangles(polygon: list) -> list:
+    return [(polygon[0], polygon[i], polygon[i + 1]) for i in range(1, len(polygon) - 1)]
+
+
+def read_obj(path: str) -> (np.ndarray, np.ndarray):
+    """ вершины и треугольники из OBJ (строки v и f; текстурные координаты и нормали пропускаются) """
+    vertices, faces = [], []
+    with open(path) as f:
+        for line in f:
+            if line.startswith('v '):
+                vertices.append(line.split()[1:4])
+            elif line.startswith('f '):
+                # v, v/vt, v//vn, v/vt/vn; отрицательные номера отсчитываются от конца списка вершин
+                polygon = [int(item.split('/')[0]) for item in line.split()[1:]]
+                polygon = [i - 1 if i > 0 else len(vertices) + i for i in polygon]
+                faces.extend(fan_triangles(polygon))
+
+    return np.array(vertices, dtype=float).reshape(-1, 3), np.array(faces, dtype=np.int64).reshape(-1, 3)
+
+
+def read_ply_header(f) -> (str, list):
+    """ формат и элементы заголовка PLY: [(имя, количество, [(свойство, тип или (тип длины, тип элемента))])] """
+    if f.readline().strip() != b'ply':
+        raise ValueError('Not a PLY file')
+    file_format, elements = None, []
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError('Unexpected end of PLY header')
+        words = line.decode('ascii').split()
+        if not words or words[0] in ('comment', 'obj_info'):
+            continue
+        if words[0] == 'end_header':
+            return file_format, elements
+        if words[0] == 'format':
+            file_format = words[1]
+        elif words[0] == 'element':
+            elements.append((words[1], int(words[2]), []))
+        elif words[0] == 'property' and words[1] == 'list':
+            elements[-1][2].append((words[4], (PLY_TYPES[words[2]], PLY_TYPES[words[3]])))
+        elif words[0] == 'property':
+            elements[-1][2].append((words[2], PLY_TYPES[words[1]]))
+
+
+def read_ply_faces(data: bytes, offset: int, count: int, properties: list, order: str) -> (np.ndarray, int):
+    """ грани PLY; если все они треугольники, читаются одним структурным массивом, иначе по одной """
+    fields = []
+    for name, kind in properties:
+        if isinstance(kind, tuple):
+            fields.append((name, order + kind[0]))
+            fields.append((name + '_items', order + kind[1], 3))
+        else:
+            fields.append((name, order + kind))
+    lists = [name for name, kind in properties if isinstance(kind, tuple)]
+
+    if len(lists) == 1:
+        dtype = np.dtype(fields)
+        if offset + count * dtype.itemsize <= len(data):
+            records = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            if (records[lists[0]] == 3).all():
+                return records[lists[0] + '_items'].astype(np.int64), offset + count * dtype.itemsize
+
+    faces = []
+    for _ in range(count):
+        for name, kind in properties:
+            if not isinstance(kind, tuple):
+                offset += np.dtype(kind).itemsize
+                continue
+            length_type, item_type = np.dtype(order + kind[0]), np.dtype(order + kind[1])
+            length = int(np.frombuffer(data, dtype=length_type, count=1, offset=offset)[0])
+            offset += length_type.itemsize
+            items = np.frombuffer(data, dtype=item_type, count=length, offset=offset).tolist()
+            offset += length * item_type.itemsize
+            if name in ('vertex_indices', 'vertex_index'):
+                faces.extend(fan_triangles(items))
+    return np.array(faces, dtype=np.int64).reshape(-1, 3), offset
+
+
+def read_ply(path: str) -> (np.ndarray, np.ndarray):
+    """ вершины и треугольники из двоичного PLY (little или big endian) """
+    with open(path, 'rb') as f:
+        file_format, elements = read_ply_header(f)
+        data = f.read()
+
+    if file_format == 'binary_little_endian':
+        order = '<'
+    elif file_format == 'binary_big_endian':
+        order = '>'
+    else:
+        raise ValueError('Unsupported PLY format: {}'.format(file_format))
+
+    vertices = np.empty((0, 3))
+    faces = np.empty((0, 3), dtype=np.int64)
+    offset = 0
+    for name, count, properties in elements:
+        if name == 'face':
+            faces, offset = read_ply_faces(data, offset, count, properties, order)
+            continue
+        if any(isinstance(kind, tuple) for _, kind in properties):
+            raise ValueError('List properties are supported only in faces')
+        dtype = np.dtype([(prop, order + kind) for prop, kind in properties])
+        records = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        offset += count * dtype.itemsize
+        if name == 'vertex':
+            vertices = np.column_stack((records['x'], records['y'], records['z'])).astype(float)
+
+    return vertices, faces
+
+
+READERS = {
+    'obj': read_obj,
+    'ply': read_ply,
+}
+
+
+def cache_paths(path: str) -> (str, str):
+    return path + '.vertices.npy', path + '.faces.npy'
+
+
+def load_mesh_arrays(path: str, cache: bool = True) -> (np.ndarray, np.ndarray):
+    """
+    Вершины и треугольники сетки из OBJ или PLY. С cache двоичная копия массивов
+    пишется рядом с файлом и при следующих загрузках отображается в память.
+    """
+    extension = path.rsplit('.', 1)[-1].lower()
+    if extension not in READERS:
+        raise ValueError('Unsupported mesh format: {}'.format(extension))
+
+    vertices_path, faces_path = cache_paths(path)
+    if cache and all(os.path.exists(p) and os.path.getmtime(p) >= os.path.getmtime(path)
+                     for p in (vertices_path, faces_path)):
+        return np.load(vertices_path, mmap_mode='r'), np.load(faces_path, mmap_mode='r')
+
+    vertices, faces = READERS[extension](path)
+    if faces.size and (faces.min() < 0 or faces.max() >= len(vertices)):
+        raise ValueError('Face refers to a missing vertex in {}'.format(path))
+    if cache:
+        try:
+            np.save(vertices_path, vertices)
+            np.save(faces_path, faces)
+        except OSError as e:
+            print('Mesh cache was not written: {}'.format(e), file=sys.stderr)
+    return vertices, faces
+
+
+def load_bvh(path: str, transform: np.ndarray) -> BVH:
+    """ BVH сетки из кэша, если он свежее файла сетки и построен при том же масштабе и сдвиге """
+    bvh_path = path + '.bvh.npz'
+    if not os.path.exists(bvh_path) or os.path.getmtime(bvh_path) < os.path.getmtime(path):
+        return None
+    with np.load(bvh_path) as arrays:
+        if not np.array_equal(arrays['transform'], transform):
+            return None
+        return BVH.from_arrays(arrays)
+
+
+def save_bvh(path: str, transform: np.ndarray, bvh: BVH):
+    try:
+        np.savez(path + '.bvh.npz', transform=transform, **bvh.to_arrays())
+    except OSError as e:
+        print('Mesh cache was not written: {}'.format(e), file=sys.stderr)
+
+
+def load_mesh(path: str, material: Material, scale: float = 1., offset=(0, 0, 0), cache: bool = True,
+              eps: float = MESH_EPS) -> TriangleMesh:
+    """
+    Сетка из файла как одна фигура TriangleMesh, с масштабом и сдвигом вершин.
+    С cache рядом с файлом сохраняется и BVH по треугольникам: её построение
+    для больших сеток дороже самой загрузки.
+    """
+    vertices, faces = load_mesh_arrays(path, cache=cache)
+    transform = np.array([scale, *offset], dtype=float)
+    if scale != 1 or any(offset):
+        vertices = vertices * scale + np.asarray(offset, dtype=float)
+
+    bvh = load_bvh(path, transform) if cache else None
+    mesh = TriangleMesh(vertices, faces, material, eps=eps, bvh=bvh)
+    if cache and bvh is None and mesh.bvh is not None:
+        save_bvh(path, transform, mesh.bvh)
+    return mesh
@@ -0,0 +1,149 @@
+"""
+Микрозамер скалярной векторной математики трассировщика.
+
+    python point_benchmark.py
+    python point_benchmark.py -n 200000 --size 48
+
+Сравнивает прежний Point (объект со словарём, квадратный корень через numpy)
+с нынешним (__slots__, math, совмещённые операции) на ядре, которое
+скалярный Tracer выполняет на каждое попадание: точка попадания, направление
+на источник, косинусы, отражение и накопление цвета. Для каждого варианта
+печатаются время ядра, число созданных векторов и память на один вектор,
+а для всей скалярной трассировки демонстрационной сцены - векторы на луч.
+"""
+import argparse
+import sys
+import time
+import timeit
+
+import numpy as np
+
+import tracer
+from tracer import Point, Tracer, build_scene, demo_objects
+
+
+class DictPoint:
+    """ Point в прежнем виде: словарь на каждый объект, np.sqrt и np.abs для чисел """
+
+    def __init__(self, x, y, z):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def __add__(self, p):
+        return DictPoint(self.x + p.x, self.y + p.y, self.z + p.z)
+
+    def __sub__(self, p):
+        return DictPoint(self.x - p.x, self.y - p.y, self.z - p.z)
+
+    def __mul__(self, p):
+        return self.x * p.x + self.y * p.y + self.z * p.z
+
+    def vector_on_scalar_mult(self, dot):
+        return DictPoint(self.x * dot, self.y * dot, self.z * dot)
+
+    def get_length(self):
+        return np.sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
+
+    def normalize(self):
+        length = self.get_length()
+        if np.abs(length) <= 0.0001:
+            length = 1
+        return DictPoint(self.x / length, self.y / length, self.z / length)
+
+
+def plain_kernel(camera, direction, normal, light, color, t: float, weight: float):
+    """ попадание, как его считал прежний Tracer: отдельная операция на каждый шаг """
+    point = direction.vector_on_scalar_mult(t) + camera
+    light_direction = (light - point).normalize()
+    light_cos = light_direction * normal
+    specular_cos = (light_direction - normal.vector_on_scalar_mult(light_cos * 2)) * direction
+    reflected = direction - normal.vector_on_scalar_mult(2 * (direction * normal))
+    shaded = (normal.vector_on_scalar_mult(light_cos) + type(normal)(specular_cos, specular_cos, specular_cos))
+    return color + shaded.vector_on_scalar_mult(weight), reflected
+
+
+def fused_kernel(camera, direction, normal, light, color, t: float, weight: float):
+    """ то же попадание на совмещённых операциях нынешнего Point """
+    point = camera.madd(direction, t)
+    light_direction = (light - point).normalize()
+    light_cos = light_direction * normal
+    specular_cos = light_direction.madd(normal, -(light_cos * 2)) * direction
+    reflected = direction.madd(normal, -(2 * (direction * normal)))
+    color = Point(color.x + (normal.x * light_cos + specular_cos) * weight,
+                  color.y + (normal.y * light_cos + specular_cos) * weight,
+                  color.z + (normal.z * light_cos + specular_cos) * weight)
+    return color, reflected
+
+
+def object_size(p) -> int:
+    size = sys.getsizeof(p)
+    if hasattr(p, '__dict__'):
+        size += sys.getsizeof(p.__dict__)
+    return size
+
+
+def count_points(cls, action) -> int:
+    """ число объектов cls, созданных за вызов action """
+    created = 0
+    original = cls.__init__
+
+    def counting_init(self, x, y, z):
+        nonlocal created
+        created += 1
+        original(self, x, y, z)
+
+    cls.__init__ = counting_init
+    try:
+        action()
+    finally:
+        cls.__init__ = original
+    return created
+
+
+def kernel_case(name: str, cls, kernel, number: int) -> dict:
+    args = (cls(0., 0., 0.), cls(0.1, 0.2, 0.97).normalize(), cls(0., 0.6, -0.8), cls(0.3, 0.5, 0.5),
+            cls(0., 0., 0.), 1.7, 0.8)
+    seconds = min(timeit.repeat(lambda: kernel(*args), number=number, repeat=3))
+    return {
+        'variant': name,
+        'ns_per_hit': seconds / number * 1e9,
+        'vectors_per_hit': count_points(cls, lambda: kernel(*args)),
+        'bytes_per_vector': object_size(args[0]),
+    }
+
+
+def trace_case(size: int) -> dict:
+    sphere, tetrahedron_points = demo_objects()
+    shapes, lights = build_scene(sphere, tetrahedron_points)
+    scene = Tracer(camera=Point(0, 0, 0), width=size, height=size, shapes=shapes, lights=lights)
+    rays = size * size
+
+    started = time.perf_counter()
+    scene.trace_scalar()
+    seconds = time.perf_counter() - started
+    return {
+        'rays_per_second': rays / seconds,
+        'vectors_per_ray': count_points(tracer.Point, scene.trace_scalar) / rays,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Micro-benchmark the scalar vector type of the tracer.')
+    parser.add_argument('-n', '--number', type=int, default=100000, help='kernel calls per timing run')
+    parser.add_argument('--size', type=int, default=32, help='frame size for the scalar trace')
+    args = parser.parse_args(argv)
+
+    for case in (kernel_case('dict Point, plain ops', DictPoint, plain_kernel, args.number),
+                 kernel_case('slotted Point, plain ops', Point, plain_kernel, args.number),
+                 kernel_case('slotted Point, fused ops', Point, fused_kernel, args.number)):
+        print('{variant:<26} {ns_per_hit:>8.0f} ns/hit {vectors_per_hit:>3} vectors/hit '
+              '{bytes_per_vector:>4} bytes/vector'.format(**case))
+
+    result = trace_case(args.size)
+    print('trace_scalar {size}x{size}: {rays_per_second:.0f} rays/s, {vectors_per_ray:.1f} vectors/ray'.format(
+        size=args.size, **result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Кэш готовых кадров на диске с адресацией по содержимому сцены.
+
+    cache = RenderCache('.render_cache', max_bytes=512 * 2 ** 20)
+    rgb = cache.render(tracer, workers=4)
+
+Ключ - Tracer.scene_hash(): одинаковые сцена, камера, разрешение и версия
+движка дают тот же файл <ключ>.npy. При попадании кадр не трассируется,
+а отображается из файла в память (только для чтения). Время последнего
+использования хранится во времени изменения файла; когда кэш превышает
+max_bytes, удаляются давно не использованные кадры.
+"""
+import os
+
+import numpy as np
+
+from tracer import Tracer
+
+
+class RenderCache:
+    def __init__(self, directory: str, max_bytes: int = 512 * 2 ** 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.npy')
+
+    def get(self, key: str) -> np.ndarray:
+        """ кадр по ключу, отображённый в память, или None """
+        path = self.path(key)
+        try:
+            frame = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        os.utime(path)
+        return frame
+
+    def put(self, key: str, frame: np.ndarray) -> np.ndarray:
+        """ сохранение кадра (через временный файл, чтобы не оставить недописанный) и вытеснение старых """
+        path = self.path(key)
+        temporary = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temporary, 'wb') as f:
+            np.save(f, np.ascontiguousarray(frame, dtype=np.uint8))
+        os.replace(temporary, path)
+        self.evict()
+        return np.load(path, mmap_mode='r') if os.path.exists(path) else frame
+
+    def entries(self) -> list:
+        """ (время использования, размер, путь) всех кадров кэша, от давно использованных к недавним """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npy'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+        return sorted(entries)
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def render(self, tracer: Tracer, workers: int = 1) -> np.ndarray:
+        """ кадр сцены трассировщика: из кэша, если он там есть, иначе tracer.trace с сохранением """
+        key = tracer.scene_hash()
+        frame = self.get(key)
+        if frame is not None and frame.shape == (tracer.height, tracer.width, 3):
+            self.hits += 1
+            return frame
+
+        self.misses += 1
+        tracer.reset()
+        return self.put(key, tracer.trace(workers=workers))
@@ -0,0 +1,216 @@
+"""
+Рендер сцен без окна: описание сцены читается из JSON или YAML, кадр пишется в PNG или PPM.
+
+    python render_cli.py scenes/demo.json -o out --workers 8
+    python render_cli.py a.json b.yaml c.json -f ppm
+    python render_cli.py poster.json --width 16384 --height 16384 --stream -w 8
+
+За один запуск можно отрисовать сколько угодно сцен; если в описании есть
+список "frames", каждый его элемент дополняет (перекрывает) поля сцены
+и даёт отдельный кадр. Трассировщик при этом один на весь запуск.
+
+С --stream кадр целиком в памяти не держится: он считается полосами по
+--band-height строк, и каждая готовая полоса сразу дописывается в PNG/PPM
+или в отображённый в память .npy, так что память ограничена высотой полосы.
+С --antialias N пиксели на границах досчитываются до N лучей (Tracer.trace_adaptive).
+С --cache DIR обычные кадры берутся из кэша на диске, если та же сцена уже рендерилась.
+
+Формат описания:
+
+    {
+      "width": 400, "height": 400, "camera": [0, 0, 0],
+      "max_depth": 5, "background": [1, 1, 1],
+      "light_threshold": 0.001, "light_samples": 16,
+      "materials": {"glass": {"refractive": 1.5, "diffuse": [0.2, 0.2, 0.2],
+                              "specular": 10, "albedo": [1, 0.5], "transparency": 0.8}},
+      "lights": [{"intensity": 0.8, "position": [0, 0.4, 1]}],
+      "shapes": [
+        {"type": "sphere", "center": [0.3, 0.2, 1], "radius": 0.1, "material": "green"},
+        {"type": "side", "points": [[...], [...], [...], [...]], "norm": [1, 0, 0], "material": "white"},
+        {"type": "triangle", "points": [[...], [...], [...]], "material": "yellow"},
+        {"type": "tetrahedron", "points": [[...], [...], [...], [...]], "material": "yellow"},
+        {"type": "mesh", "path": "models/bunny.ply", "scale": 2, "offset": [0, -0.2, 1.5], "material": "white"}
+      ],
+      "frames": [{"camera": [0, 0, 0]}, {"camera": [0, 0, 0.5]}]
+    }
+
+light_threshold и light_samples (необязательные) включают отсев слабых
+источников и выборку фиксированного числа источников на точку (см. Tracer).
+Путь сетки (OBJ или двоичный PLY) считается от файла описания сцены.
+Материал задаётся именем (встроенные green, red, white, yellow, blue, gray
+или описанные в "materials") либо прямо словарём.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+from image_io import WRITERS, open_image_stream, write_image
+from mesh_io import load_mesh
+from render_cache import RenderCache
+from tracer import Point, Material, Sphere, Side, TetrahedronSide, Light, Tracer, \
+    green, red, white, yellow, blue, gray
+
+BUILTIN_MATERIALS = {
+    'green': green,
+    'red': red,
+    'white': white,
+    'yellow': yellow,
+    'blue': blue,
+    'gray': gray,
+}
+
+
+def read_description(path: str) -> dict:
+    """ чтение описания сцены из JSON или YAML (для YAML нужен PyYAML) """
+    with open(path) as f:
+        if path.lower().endswith(('.yaml', '.yml')):
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def make_material(data: dict) -> Material:
+    return Material(refractive=data.get('refractive', 1.0),
+                    diffuse=Point(*data['diffuse']),
+                    specular=data.get('specular', 10),
+                    albedo=list(data.get('albedo', [1, 0.5])),
+                    transparency=data.get('transparency', 0.0))
+
+
+def make_materials(description: dict) -> dict:
+    materials = dict(BUILTIN_MATERIALS)
+    for name, data in description.get('materials', {}).items():
+        materials[name] = make_material(data)
+    return materials
+
+
+def resolve_material(value, materials: dict) -> Material:
+    if isinstance(value, dict):
+        return make_material(value)
+    if value not in materials:
+        raise ValueError('Unknown material: {}'.format(value))
+    return materials[value]
+
+
+def make_shapes(data: dict, materials: dict, base_dir: str = '.') -> list:
+    """ фигуры по одному элементу "shapes" (тетраэдр даёт четыре грани); base_dir - папка описания сцены """
+    kind = data['type']
+    material = resolve_material(data.get('material', 'white'), materials)
+    points = [Point(*p) for p in data.get('points', [])]
+
+    if kind == 'sphere':
+        return [Sphere(Point(*data['center']), data['radius'], material)]
+    if kind == 'side':
+        return [Side(points, material=material, norm=Point(*data['norm']))]
+    if kind == 'triangle':
+        return [TetrahedronSide(points, material)]
+    if kind == 'tetrahedron':
+        return [TetrahedronSide(side, material) for side in itertools.combinations(points, 3)]
+    if kind == 'mesh':
+        return [load_mesh(os.path.join(base_dir, data['path']), material, scale=data.get('scale', 1.),
+                          offset=data.get('offset', (0, 0, 0)))]
+    raise ValueError('Unknown shape type: {}'.format(kind))
+
+
+def configure_tracer(tracer: Tracer, description: dict, allocate: bool = True, base_dir: str = '.') -> Tracer:
+    """
+    Настройка трассировщика (переиспользуемого между кадрами) под описание сцены;
+    allocate=False - без кадра в памяти, для рендера полосами; base_dir - папка описания сцены
+    """
+    materials = make_materials(description)
+    tracer.shapes = [shape for data in description.get('shapes', [])
+                     for shape in make_shapes(data, materials, base_dir)]
+    tracer.lights = [Light(intensity=light['intensity'], position=Point(*light['position']))
+                     for light in description.get('lights', [])]
+    tracer.camera = Point(*description.get('camera', (0, 0, 0)))
+    tracer.max_depth = description.get('max_depth', 5)
+    tracer.light_threshold = description.get('light_threshold')
+    tracer.light_samples = description.get('light_samples')
+    tracer.background_color = Point(*description.get('background', (1, 1, 1)))
+    tracer.resize(description.get('width', 400), description.get('height', 400), allocate=allocate)
+    return tracer
+
+
+def frames(description: dict) -> list:
+    """ описания отдельных кадров: сцена, дополненная каждым элементом "frames" """
+    base = {key: value for key, value in description.items() if key != 'frames'}
+    if not description.get('frames'):
+        return [base]
+    return [dict(base, **frame) for frame in description['frames']]
+
+
+def render_files(paths: list, output_dir: str, image_format: str, workers: int = 1, overrides: dict = None,
+                 stream: bool = False, band_height: int = 16, antialias: int = 0, aa_threshold: float = 0.1,
+                 cache: RenderCache = None) -> list:
+    """ рендер всех кадров всех сцен одним трассировщиком; возвращает пути записанных файлов """
+    tracer = Tracer()
+    written = []
+    os.makedirs(output_dir, exist_ok=True)
+
+    for path in paths:
+        scene_frames = frames(read_description(path))
+        name = os.path.splitext(os.path.basename(path))[0]
+        for number, frame in enumerate(scene_frames):
+            frame.update(overrides or {})
+            configure_tracer(tracer, frame, allocate=not stream, base_dir=os.path.dirname(path))
+
+            file_name = name if len(scene_frames) == 1 else '{}_{:04d}'.format(name, number)
+            output = os.path.join(output_dir, '{}.{}'.format(file_name, image_format))
+
+            started = time.perf_counter()
+            extra = ''
+            if antialias > 1:
+                _, extra_rays = tracer.trace_adaptive(threshold=aa_threshold, max_samples=antialias)
+                extra = ', {} extra rays'.format(extra_rays)
+                write_image(output, tracer.framebuffer)
+            elif stream:
+                with open_image_stream(output, tracer.width, tracer.height) as image:
+                    for _, _, rgb in tracer.render_bands(band_height=band_height, workers=workers):
+                        image.write_rows(rgb)
+            elif cache is not None:
+                hits = cache.hits
+                write_image(output, cache.render(tracer, workers=workers))
+                extra = ', cached' if cache.hits > hits else ''
+            else:
+                tracer.reset()
+                tracer.trace(workers=workers)
+                write_image(output, tracer.framebuffer)
+            written.append(output)
+            print('{} -> {} ({:.2f} s{})'.format(path, output, time.perf_counter() - started, extra), file=sys.stderr)
+
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render global_illumination scenes without a display.')
+    parser.add_argument('scenes', nargs='+', help='scene descriptions (.json, .yaml, .yml)')
+    parser.add_argument('-o', '--output-dir', default='.', help='directory for rendered images')
+    parser.add_argument('-f', '--format', default='png', choices=sorted(WRITERS), help='output image format')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='processes for tile rendering')
+    parser.add_argument('--width', type=int, help='override scene width')
+    parser.add_argument('--height', type=int, help='override scene height')
+    parser.add_argument('--stream', action='store_true',
+                        help='render in bands written straight to the output file, without a full frame in memory')
+    parser.add_argument('--band-height', type=int, default=16, help='rows per band for --stream')
+    parser.add_argument('--antialias', type=int, default=0, metavar='SAMPLES',
+                        help='adaptive anti-aliasing with up to SAMPLES rays per edge pixel (4, 16, 64)')
+    parser.add_argument('--aa-threshold', type=float, default=0.1,
+                        help='colour difference (0..1) between neighbours that triggers extra samples')
+    parser.add_argument('--cache', metavar='DIR', help='directory of cached frames keyed by scene hash')
+    parser.add_argument('--cache-size', type=float, default=512, help='cache size limit in MB')
+    args = parser.parse_args(argv)
+    if args.antialias > 1 and args.stream:
+        parser.error('--antialias needs the whole frame and cannot be combined with --stream')
+
+    overrides = {key: value for key, value in (('width', args.width), ('height', args.height)) if value}
+    cache = RenderCache(args.cache, max_bytes=int(args.cache_size * 2 ** 20)) if args.cache else None
+    render_files(args.scenes, args.output_dir, args.format, workers=args.workers, overrides=overrides,
+                 stream=args.stream, band_height=args.band_height, antialias=args.antialias,
+                 aa_threshold=args.aa_threshold, cache=cache)
+
+
+if __name__ == '__main__':
+    main()
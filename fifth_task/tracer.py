@@ -0,0 +1,1339 @@
+from abc import abstractmethod
+from collections import deque, namedtuple
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import hashlib
+import itertools
+import math
+
+from bvh import BVH
+from instrumentation import stats
+
+EPS = 0.0001
+# версия движка для ключей кэша рендеров: увеличивается, когда меняется картинка при той же сцене
+ENGINE_VERSION = 1
+# шаги сеток постепенного рендера (Tracer.progressive): каждый 8-й пиксель, 4-й, 2-й, все
+PREVIEW_STEPS = (8, 4, 2, 1)
+
+
+class Point:
+    """
+    Вектор из трёх чисел. Поля в __slots__ (без словаря на каждый объект), скалярная
+    математика через math; совмещённая операция madd считает за один шаг то, что
+    иначе создавало бы промежуточный объект.
+    """
+    __slots__ = ('x', 'y', 'z')
+
+    def __init__(self, x, y, z):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def __add__(self, p):
+        return Point(self.x + p.x, self.y + p.y, self.z + p.z)
+
+    def __sub__(self, p):
+        return Point(self.x - p.x, self.y - p.y, self.z - p.z)
+
+    def __mul__(self, p):
+        return self.x * p.x + self.y * p.y + self.z * p.z
+
+    def vector_on_scalar_mult(self, dot):
+        return Point(self.x * dot, self.y * dot, self.z * dot)
+
+    def vector_mul(self, p):
+        return Point(self.y * p.z - self.z * p.y, self.z * p.x - self.x * p.z, self.x * p.y - self.y * p.x)
+
+    def __neg__(self):
+        return Point(-self.x, -self.y, -self.z)
+
+    def get_length(self):
+        return math.sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
+
+    def normalize(self):
+        length = self.get_length()
+        if abs(length) <= 0.0001:
+            length = 1
+        return Point(self.x / length, self.y / length, self.z / length)
+
+    def madd(self, p, k: float):
+        """ self + p * k одним объектом; совпадает с p.vector_on_scalar_mult(k) + self до бита """
+        return Point(self.x + p.x * k, self.y + p.y * k, self.z + p.z * k)
+
+    def key_data(self) -> list:
+        return [float(self.x), float(self.y), float(self.z)]
+
+    def to_array(self):
+        return np.array([self.x, self.y, self.z], dtype=float)
+
+    def to_rgb(self):
+        red_color = int(255 * min(1., max(0., self.x)))
+        green_color = int(255 * min(1., max(0., self.y)))
+        blue_color = int(255 * min(1., max(0., self.z)))
+        return red_color, green_color, blue_color
+
+
+def dot_rows(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """ скалярное произведение векторов по последней оси массивов (..., 3) """
+    return a[..., 0] * b[..., 0] + a[..., 1] * b[..., 1] + a[..., 2] * b[..., 2]
+
+
+def cross_rows(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """ векторное произведение по последней оси массивов (..., 3) """
+    return np.stack((a[..., 1] * b[..., 2] - a[..., 2] * b[..., 1],
+                     a[..., 2] * b[..., 0] - a[..., 0] * b[..., 2],
+                     a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]), axis=-1)
+
+
+def normalize_rows(v: np.ndarray) -> np.ndarray:
+    """ нормировка массива векторов по тем же правилам, что и Point.normalize """
+    length = np.sqrt(dot_rows(v, v))
+    length = np.where(np.abs(length) <= 0.0001, 1., length)
+    return v / length[..., None]
+
+
+def colors_to_rgb(colors: np.ndarray) -> np.ndarray:
+    """ пакетный аналог Point.to_rgb """
+    colors = np.nan_to_num(colors, nan=0.)
+    return (255 * np.clip(colors, 0., 1.)).astype(np.uint8)
+
+
+def hash_uniform(seed: int, keys: np.ndarray) -> np.ndarray:
+    """
+    Числа из [0, 1), зависящие только от seed и целых ключей keys (хэш splitmix64):
+    в отличие от общего генератора, не зависят от порядка и разбиения расчёта
+    """
+    z = keys.astype(np.uint64) + np.uint64(seed * 0x9E3779B97F4A7C15 % 2 ** 64)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z ^= z >> np.uint64(31)
+    return (z >> np.uint64(11)).astype(float) / 2. ** 53
+
+
+def rays_intersect_triangles(cameras: np.ndarray, directions: np.ndarray, v0: np.ndarray,
+                             edge1: np.ndarray, edge2: np.ndarray, eps: float) -> np.ndarray:
+    """
+    Пакетный алгоритм Мёллера-Трумбора для N лучей и T треугольников,
+    заданных вершиной v0 и рёбрами edge1, edge2 (массивы (T, 3)).
+    Возвращает расстояния (N, T), np.inf при промахе.
+    """
+    cameras = cameras[:, None, :]
+    directions = directions[:, None, :]
+    h = cross_rows(directions, edge2)
+    a = dot_rows(edge1, h)
+
+    hit = (a <= -eps) | (a >= eps)
+    f = 1. / np.where(hit, a, 1.)
+
+    s = cameras - v0
+    u = dot_rows(s, h) * f
+    hit &= (u >= 0) & (u <= 1)
+
+    q = cross_rows(s, edge1)
+    v = dot_rows(directions, q) * f
+    hit &= (v >= 0) & (v + u <= 1)
+
+    t = dot_rows(edge2, q) * f
+
+    return np.where(hit & (t > eps), t, np.inf)
+
+
+def feed_hash(hasher, value):
+    """ устойчивое (не зависящее от запуска) добавление значения сцены в хэш """
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        hasher.update('array{}{}'.format(value.dtype.str, value.shape).encode())
+        hasher.update(value.tobytes())
+    elif isinstance(value, (list, tuple)):
+        hasher.update(b'list%d' % len(value))
+        for item in value:
+            feed_hash(hasher, item)
+    elif value is None or isinstance(value, (bool, int, float, str, np.generic)):
+        hasher.update('{}:{!r};'.format(type(value).__name__, value).encode())
+    elif isinstance(value, (Point, Material, Shape, Light)):
+        hasher.update(type(value).__name__.encode())
+        feed_hash(hasher, value.key_data())
+    else:
+        raise TypeError('Cannot hash scene value of type {}'.format(type(value).__name__))
+
+
+class Material:
+    def __init__(self, refractive: float, diffuse: Point, specular: float, albedo: list, transparency: float):
+        self.refractive = refractive
+        self.diffuse = diffuse
+        self.specular = specular
+        self.albedo = albedo
+        self.transparency = transparency
+
+    def key_data(self) -> list:
+        return [self.refractive, self.diffuse, self.specular, list(self.albedo), self.transparency]
+
+
+# Используемые материалы
+green = Material(refractive=1.0,
+                 albedo=[1, 0.5],
+                 diffuse=Point(0, 0.3, 0),
+                 specular=10,
+                 transparency=0.2)
+
+red = Material(refractive=1.0,
+               albedo=[1, 0.5],
+               diffuse=Point(1, 0, 0),
+               specular=10,
+               transparency=0.0)
+
+white = Material(refractive=1.0,
+                 albedo=[1, 0.5],
+                 diffuse=Point(1, 1, 1),
+                 specular=10,
+                 transparency=0.0)
+
+yellow = Material(refractive=1.0,
+                  albedo=[1, 0.5],
+                  diffuse=Point(1, 1, (102 / 255)),
+                  specular=10,
+                  transparency=0)
+
+blue = Material(refractive=1.0,
+                albedo=[1, 0.5],
+                diffuse=Point(0.5, 0.3, 1),
+                specular=10,
+                transparency=0)
+
+gray = Material(refractive=1.0,
+                albedo=[1, 0.5],
+                diffuse=Point(0.8, 0.8, 0.8),
+                specular=10,
+                transparency=0)
+
+
+class Shape(Point):
+    def __init__(self, material: Material):
+        self.material = material
+
+    @abstractmethod
+    def does_ray_intersect(self, camera: Point, direction: Point) -> (bool, float):
+        """ проверка на пересечение с лучом """
+
+    @abstractmethod
+    def normal(self, point: Point) -> Point:
+        """ получение нормали """
+
+    def does_ray_intersect_face(self, camera: Point, direction: Point) -> (bool, float, int):
+        """ does_ray_intersect и номер задетой грани для фигур, составленных из нескольких граней """
+        hit, t = self.does_ray_intersect(camera=camera, direction=direction)
+        return hit, t, 0
+
+    def face_normal(self, point: Point, face: int) -> Point:
+        """ нормаль в точке на грани face (face - из does_ray_intersect_face) """
+        return self.normal(point)
+
+    def get_color(self, point: Point):
+        """ получение цвета в точке """
+        return self.material.diffuse
+
+    def does_rays_intersect(self, cameras: np.ndarray, directions: np.ndarray) -> (np.ndarray, np.ndarray):
+        """
+        Пакетная проверка на пересечение: расстояния до пересечений (np.inf при промахе)
+        и номера задетых граней для фигур, составленных из нескольких граней
+        """
+        result = np.full(len(directions), np.inf)
+        for i, (camera, direction) in enumerate(zip(cameras, directions)):
+            hit, t = self.does_ray_intersect(camera=Point(*camera), direction=Point(*direction))
+            if hit:
+                result[i] = t
+        return result, np.zeros(len(directions), dtype=int)
+
+    def normals(self, points: np.ndarray, faces: np.ndarray) -> np.ndarray:
+        """ пакетное получение нормалей в точках на гранях faces """
+        return np.array([self.normal(Point(*p)).to_array() for p in points]).reshape(-1, 3)
+
+    def get_colors(self, points: np.ndarray) -> np.ndarray:
+        """ пакетное получение цвета в точках """
+        return np.broadcast_to(self.material.diffuse.to_array(), (len(points), 3))
+
+    def bounds(self) -> (np.ndarray, np.ndarray):
+        """ ограничивающая коробка (AABB); бесконечная, если фигура её не знает """
+        return np.full(3, -np.inf), np.full(3, np.inf)
+
+    def key_data(self) -> list:
+        """ всё, от чего зависит вид фигуры, для Tracer.scene_hash; по умолчанию - открытые поля """
+        return [[name, value] for name, value in sorted(vars(self).items()) if not name.startswith('_')]
+
+
+# Участок пути лучей в G-буфере: номера лучей (пикселей), их веса, задетые фигуры,
+# точки попадания, нормали в них и направления, с которых пришли лучи
+Surface = namedtuple('Surface', ['indices', 'weights', 'shape_ids', 'points', 'normals', 'directions'])
+
+
+class GBuffer:
+    """
+    Геометрия последнего кадра: для каждой глубины участки лучей, попавших в фигуры
+    (первый участок - первичные лучи пикселей), и лучи, ушедшие в фон, с их весами.
+    От источников света и от diffuse, albedo и specular материалов она не зависит,
+    поэтому после их правки кадр пересчитывается одним освещением, без трассировки.
+    """
+    def __init__(self, key: tuple):
+        self.key = key
+        self.surfaces: list = []  # Surface по глубинам
+        self.missed: list = []  # (номера лучей, веса) по глубинам
+
+
+class Tracer:
+    def __init__(self, camera: Point = None, width: int = 0, height: int = 0, shapes: list = None,
+                 lights: list = None, buffer: np.ndarray = None):
+        self.camera: Point = camera if camera is not None else Point(0, 0, 0)
+        self.shapes: list = shapes if shapes is not None else list()
+        # не больше max_depth преломлений на луч; лучи с накопленным весом
+        # (произведением прозрачностей) не выше min_weight дальше не продолжаются
+        self.max_depth: int = 5
+        self.min_weight: float = 0.001
+        self.background_color = Point(1, 1, 1)
+
+        self.lights: list = lights if lights is not None else list()
+        # Много источников (только пакетный путь): при light_threshold источник не освещает точку
+        # и не стоит теневого луча, если его оценка intensity * cos ниже порога; при light_samples
+        # на точку берётся столько источников, выбранных с вероятностью по той же оценке,
+        # а их вклад делится на вероятность выбора (несмещённая оценка суммы по всем источникам).
+        # Выбор зависит только от light_seed, номера пикселя и глубины, так что кадр одинаков
+        # при любом числе процессов, разбиении на плитки и полосы и при повторном запуске
+        self.light_threshold: float = None
+        self.light_samples: int = None
+        self.light_seed: int = 0
+
+        self.width: int = 0
+        self.height: int = 0
+        self.size: int = 0
+        self.framebuffer: np.ndarray = np.zeros((0, 0, 3), dtype=np.uint8)
+        self.grid = None
+        # при keep_gbuffer однопроцессный trace сохраняет геометрию кадра для relight
+        self.keep_gbuffer: bool = False
+        self.gbuffer: GBuffer = None
+        self.resize(width, height, buffer)
+
+    def scene_hash(self) -> str:
+        """
+        Устойчивый хэш всего, от чего зависит кадр trace: фигуры с материалами, источники,
+        камера, разрешение, ограничения путей, фон, режим освещения и ENGINE_VERSION
+        """
+        hasher = hashlib.sha256()
+        feed_hash(hasher, ['engine', ENGINE_VERSION])
+        feed_hash(hasher, [self.camera, self.width, self.height, self.max_depth, self.min_weight,
+                           self.background_color, self.light_threshold, self.light_samples, self.light_seed])
+        feed_hash(hasher, list(self.lights))
+        feed_hash(hasher, list(self.shapes))
+        return hasher.hexdigest()
+
+    def resize(self, width: int, height: int, buffer: np.ndarray = None, allocate: bool = True):
+        """
+        Смена разрешения. Кадр (непрерывный массив (height, width, 3) uint8, в который
+        трассировка пишет напрямую) и сетка направлений первичных лучей пересоздаются
+        только при изменении размера; иначе переиспользуются от кадра к кадру.
+        При allocate=False кадр не заводится вовсе: так рендерят полосами (render_bands)
+        кадры, которые целиком в память не помещаются.
+        """
+        if (width, height) == (self.width, self.height) and buffer is None and \
+                (not allocate or self.framebuffer.shape[:2] == (height, width)):
+            return
+        self.width, self.height = width, height
+        self.size = max(width, height)
+        if buffer is None:
+            buffer = np.zeros((height, width, 3) if allocate else (0, 0, 3), dtype=np.uint8)
+        self.framebuffer = buffer.reshape(height, width, 3) if allocate else buffer
+        self.grid = None
+
+    def reset(self):
+        """ очистка кадра перед новым рендером в том же контексте """
+        self.framebuffer[:] = 0
+
+    def ray_grid(self) -> (np.ndarray, np.ndarray, np.ndarray):
+        """ x, y и направления первичных лучей всех пикселей; считаются один раз на разрешение """
+        if self.grid is None:
+            x, y = self.pixel_coordinates(np.arange(self.width * self.height))
+            self.grid = (x, y, normalize_rows(np.column_stack((x, y, np.ones(len(x))))))
+        return self.grid
+
+    @property
+    def x(self) -> np.ndarray:
+        return self.ray_grid()[0]
+
+    @property
+    def y(self) -> np.ndarray:
+        return self.ray_grid()[1]
+
+    @property
+    def directions(self) -> np.ndarray:
+        return self.ray_grid()[2]
+
+    @property
+    def buffer(self) -> np.ndarray:
+        """ кадр как массив (width * height, 3) в порядке номеров пикселей """
+        return self.framebuffer.reshape(-1, 3)
+
+    @property
+    def bitmap(self) -> list:
+        """ кадр в старом формате списка столбцов с кортежами цветов (для совместимости) """
+        return self.build_bitmap()
+
+    @property
+    def shapes(self) -> list:
+        return self._shapes
+
+    @shapes.setter
+    def shapes(self, shapes: list):
+        self._shapes = shapes
+        self._bvh = None
+
+    @property
+    def bvh(self) -> BVH:
+        """ BVH над self.shapes строится один раз; после правки списка на месте нужен rebuild_bvh """
+        if self._bvh is None:
+            self.rebuild_bvh()
+        return self._bvh
+
+    def rebuild_bvh(self):
+        lower, upper = zip(*(shape.bounds() for shape in self.shapes)) if self.shapes else ((), ())
+        self._bvh = BVH(np.array(lower).reshape(-1, 3), np.array(upper).reshape(-1, 3))
+
+    def closest_intersection(self, camera: Point, direction: Point, min_dist: float = EPS, max_dist: float = np.inf) \
+            -> (Shape, float, int):
+        """ ближайшая задетая фигура, расстояние до неё и номер задетой грани """
+        faces = {}
+
+        def intersect(index: int) -> float:
+            shape = self.shapes[index]
+            if stats.enabled:
+                stats.count('tests.' + type(shape).__name__)
+            hit, t, faces[index] = shape.does_ray_intersect_face(camera=camera, direction=direction)
+            return t if hit else np.inf
+
+        index, closest_distance = self.bvh.closest((camera.x, camera.y, camera.z),
+                                                   (direction.x, direction.y, direction.z),
+                                                   intersect, min_dist, max_dist)
+        if index < 0:
+            return None, closest_distance, -1
+        return self.shapes[index], closest_distance, faces[index]
+
+    def have_intersection(self, camera: Point, direction: Point, min_dist: float = EPS, max_dist: float = np.inf) \
+            -> bool:
+        if stats.enabled:
+            stats.count('rays.shadow')
+
+        def intersect(index: int) -> float:
+            shape = self.shapes[index]
+            if stats.enabled:
+                stats.count('tests.' + type(shape).__name__)
+            t = shape.does_ray_intersect(camera=camera, direction=direction)
+            return t[1] if t[0] else np.inf
+
+        return self.bvh.any_hit((camera.x, camera.y, camera.z), (direction.x, direction.y, direction.z),
+                                intersect, min_dist, max_dist)
+
+    def closest_intersections(self, cameras: np.ndarray, directions: np.ndarray, min_dist: float = EPS,
+                              max_dist=np.inf) -> (np.ndarray, np.ndarray, np.ndarray):
+        """ пакетный closest_intersection: индексы фигур в self.shapes (-1 при промахе), расстояния и грани """
+        def intersect(index: int, rays: np.ndarray) -> np.ndarray:
+            shape = self.shapes[index]
+            if stats.enabled:
+                stats.count('tests.' + type(shape).__name__, len(rays))
+            return shape.does_rays_intersect(cameras[rays], directions[rays])
+
+        return self.bvh.closest_batch(cameras, directions, intersect, min_dist, max_dist)
+
+    def have_intersections(self, cameras: np.ndarray, directions: np.ndarray, min_dist: float = EPS,
+                           max_dist=np.inf) -> np.ndarray:
+        """ пакетный have_intersection: перекрытые лучи выбывают из проверки сразу """
+        if stats.enabled:
+            stats.count('rays.shadow', len(directions))
+
+        def intersect(index: int, rays: np.ndarray) -> np.ndarray:
+            shape = self.shapes[index]
+            if stats.enabled:
+                stats.count('tests.' + type(shape).__name__, len(rays))
+            return shape.does_rays_intersect(cameras[rays], directions[rays])
+
+        return self.bvh.any_hit_batch(cameras, directions, intersect, min_dist, max_dist)
+
+    def lighting(self, point: Point, normal: Point, direction: Point, material: Material) -> (float, float):
+        diffuse: float = 0.
+        specular: float = 0.
+
+        with stats.phase('lighting'):
+            for light in self.lights:
+                position: Point = light.position
+                x, y, z = position.x - point.x, position.y - point.y, position.z - point.z
+                max_dist: float = math.sqrt(x * x + y * y + z * z)
+                length = max_dist if max_dist > 0.0001 else 1
+                light_direction = Point(x / length, y / length, z / length)
+
+                if self.have_intersection(camera=point, direction=light_direction, max_dist=max_dist):
+                    continue
+
+                light_cos: float = light_direction * normal
+                diffuse += light_cos * light.intensity
+
+                specular_cos: float = light_direction.madd(normal, -(light_cos * 2)) * direction
+                specular += np.power(specular_cos, material.specular) * light.intensity
+
+        diffuse *= material.albedo[0]
+        specular *= material.albedo[1]
+
+        return diffuse, specular
+
+    def light_keys(self, pixels: np.ndarray, depth: int) -> np.ndarray:
+        """ ключи выборки источников для точек попадания лучей пикселей pixels на глубине depth """
+        return np.asarray(pixels, dtype=np.int64) * (self.max_depth + 1) + depth
+
+    def lighting_batch(self, points: np.ndarray, normals: np.ndarray, directions: np.ndarray,
+                       albedo: np.ndarray, specular_power: np.ndarray, keys: np.ndarray = None) \
+            -> (np.ndarray, np.ndarray):
+        """
+        пакетный lighting: теневые лучи ко всем точкам пускаются одним массивом на источник;
+        keys (light_keys, по умолчанию номера точек) нужны только для выборки источников
+        """
+        if self.light_samples is not None and len(self.lights) > self.light_samples:
+            if keys is None:
+                keys = np.arange(len(points))
+            return self.sampled_lighting(points, normals, directions, albedo, specular_power, keys)
+
+        diffuse = np.zeros(len(points))
+        specular = np.zeros(len(points))
+
+        with stats.phase('lighting'):
+            for light in self.lights:
+                light_directions = light.position.to_array() - points
+                max_dist = np.sqrt(dot_rows(light_directions, light_directions))
+                light_directions = normalize_rows(light_directions)
+                light_cos = dot_rows(light_directions, normals)
+
+                if self.light_threshold is None:
+                    lit = ~self.have_intersections(points, light_directions, max_dist=max_dist)
+                else:
+                    relevant = light_cos * light.intensity >= self.light_threshold
+                    if stats.enabled:
+                        stats.count('lights.culled', len(points) - int(relevant.sum()))
+                    lit = np.zeros(len(points), dtype=bool)
+                    lit[relevant] = ~self.have_intersections(points[relevant], light_directions[relevant],
+                                                             max_dist=max_dist[relevant])
+
+                diffuse += np.where(lit, light_cos * light.intensity, 0.)
+
+                specular_cos = dot_rows(light_directions - normals * (light_cos * 2)[:, None], directions)
+                specular += np.where(lit, np.power(specular_cos, specular_power) * light.intensity, 0.)
+
+        diffuse *= albedo[:, 0]
+        specular *= albedo[:, 1]
+
+        return diffuse, specular
+
+    def sampled_lighting(self, points: np.ndarray, normals: np.ndarray, directions: np.ndarray,
+                         albedo: np.ndarray, specular_power: np.ndarray, keys: np.ndarray) \
+            -> (np.ndarray, np.ndarray):
+        """
+        lighting_batch с light_samples источниками на точку вместо всех: источник выбирается
+        с вероятностью, пропорциональной |intensity * cos| (с учётом light_threshold), теневой
+        луч идёт только к выбранным, а их вклад делится на light_samples * вероятность.
+        Случайные числа точки берутся из hash_uniform по light_seed и её ключу из keys.
+        """
+        diffuse = np.zeros(len(points))
+        specular = np.zeros(len(points))
+
+        with stats.phase('lighting'):
+            positions = np.array([light.position.to_array() for light in self.lights])
+            intensities = np.array([light.intensity for light in self.lights], dtype=float)
+
+            # оценки вкладов (N, L) - |intensity * cos|: источник со спины точки тоже входит в точную
+            # сумму lighting_batch (с отрицательным diffuse), поэтому и он может быть выбран;
+            # источники, которые lighting_batch отсекает по light_threshold, не выбираются
+            estimates = np.empty((len(points), len(self.lights)))
+            for number, position in enumerate(positions):
+                estimates[:, number] = dot_rows(normalize_rows(position - points), normals)
+            estimates *= intensities
+            if self.light_threshold is None:
+                estimates = np.abs(estimates)
+            else:
+                estimates = np.where(estimates >= self.light_threshold, np.abs(estimates), 0.)
+            totals = estimates.sum(axis=1)
+            lit_points = np.flatnonzero(totals > 0)
+            probabilities = estimates[lit_points] / totals[lit_points, None]
+            cdf = np.cumsum(probabilities, axis=1)
+
+            points, normals, directions = points[lit_points], normals[lit_points], directions[lit_points]
+            power = specular_power[lit_points]
+            keys = np.asarray(keys, dtype=np.int64)[lit_points] * self.light_samples
+            for sample in range(self.light_samples):
+                u = hash_uniform(self.light_seed, keys + sample) * cdf[:, -1]
+                chosen = np.minimum((cdf <= u[:, None]).sum(axis=1), len(self.lights) - 1)
+                weights = intensities[chosen] / (self.light_samples * probabilities[np.arange(len(chosen)), chosen])
+                if stats.enabled:
+                    stats.count('lights.sampled', len(chosen))
+
+                light_directions = positions[chosen] - points
+                max_dist = np.sqrt(dot_rows(light_directions, light_directions))
+                light_directions = normalize_rows(light_directions)
+                lit = ~self.have_intersections(points, light_directions, max_dist=max_dist)
+
+                light_cos = dot_rows(light_directions, normals)
+                diffuse[lit_points] += np.where(lit, light_cos * weights, 0.)
+
+                specular_cos = dot_rows(light_directions - normals * (light_cos * 2)[:, None], directions)
+                specular[lit_points] += np.where(lit, np.power(specular_cos, power) * weights, 0.)
+
+        diffuse *= albedo[:, 0]
+        specular *= albedo[:, 1]
+
+        return diffuse, specular
+
+    def shade(self, shape_ids: np.ndarray, points: np.ndarray, normals: np.ndarray,
+              directions: np.ndarray, keys: np.ndarray = None) -> np.ndarray:
+        """
+        цвета точек попадания (без веса луча): освещение и материалы задетых фигур;
+        keys - ключи выборки источников, как в lighting_batch
+        """
+        diffuse_colors = np.empty_like(points)
+        albedo = np.empty((len(points), 2))
+        specular_power = np.empty(len(points))
+
+        for shape_id in np.unique(shape_ids):
+            mask = shape_ids == shape_id
+            shape: Shape = self.shapes[shape_id]
+            diffuse_colors[mask] = shape.get_colors(points[mask])
+            albedo[mask] = shape.material.albedo[:2]
+            specular_power[mask] = shape.material.specular
+
+        diffuse, specular = self.lighting_batch(points=points, normals=normals, directions=directions,
+                                                albedo=albedo, specular_power=specular_power, keys=keys)
+        return diffuse_colors * diffuse[:, None] + specular[:, None]
+
+    def rays(self, cameras: np.ndarray, directions: np.ndarray, gbuffer: GBuffer = None,
+             pixels: np.ndarray = None) -> np.ndarray:
+        """
+        Пакетный аналог ray: цвета лучей массивом (N, 3).
+        Преломлённые лучи трассируются тем же пакетом с теми же ограничениями
+        max_depth и min_weight, что и в ray. Если передан gbuffer, в него
+        записываются участки путей лучей для последующего relight. pixels - номера
+        пикселей лучей в кадре (по умолчанию 0..N-1) для выборки источников.
+        """
+        colors = np.zeros((len(directions), 3))
+        weights = np.ones(len(directions))
+        indices = np.arange(len(directions))
+        pixels = indices if pixels is None else np.asarray(pixels)
+        background = self.background_color.to_array()
+
+        for depth in range(self.max_depth + 1):
+            if not indices.size:
+                break
+            if stats.enabled:
+                stats.count('rays.primary' if depth == 0 else 'rays.refraction', len(directions))
+            shape_ids, distances, faces = self.closest_intersections(cameras, directions)
+
+            missed = shape_ids < 0
+            colors[indices[missed]] += weights[missed, None] * background
+            if gbuffer is not None:
+                gbuffer.missed.append((indices[missed], weights[missed]))
+
+            hit = ~missed
+            indices, cameras, directions = indices[hit], cameras[hit], directions[hit]
+            shape_ids, distances, faces, weights = shape_ids[hit], distances[hit], faces[hit], weights[hit]
+            if not indices.size:
+                break
+
+            points = directions * distances[:, None] + cameras
+            normals = np.empty_like(points)
+            transparency = np.empty(len(points))
+            refractive = np.empty(len(points))
+
+            for shape_id in np.unique(shape_ids):
+                mask = shape_ids == shape_id
+                shape: Shape = self.shapes[shape_id]
+                normals[mask] = shape.normals(points[mask], faces[mask])
+                transparency[mask] = shape.material.transparency
+                refractive[mask] = shape.material.refractive
+
+            if gbuffer is not None:
+                gbuffer.surfaces.append(Surface(indices, weights, shape_ids, points, normals, directions))
+
+            colors[indices] += weights[:, None] * self.shade(shape_ids, points, normals, directions,
+                                                             self.light_keys(pixels[indices], depth))
+
+            weights = weights * transparency
+            alive = weights > self.min_weight
+            indices, points, directions, weights = indices[alive], points[alive], directions[alive], weights[alive]
+            normals, refractive = normals[alive], refractive[alive]
+
+            refracted_directions, refracted = self.refract_batch(directions, normals, refractive)
+            directions = np.where(refracted[:, None], refracted_directions, self.reflect_batch(directions, normals))
+            cameras = points
+
+        return colors
+
+    def ray(self, camera: Point, direction: Point) -> Point:
+        """
+        Цвет луча. Преломлённые лучи обходятся циклом, без рекурсии: вклад каждого
+        следующего участка умножается на накопленный вес (произведение прозрачностей).
+        Цикл обрывается на max_depth преломлениях или когда вес не выше min_weight;
+        при полном внутреннем отражении луч отражается.
+        """
+        color = Point(0, 0, 0)
+        weight: float = 1.
+
+        for depth in range(self.max_depth + 1):
+            if stats.enabled:
+                stats.count('rays.primary' if depth == 0 else 'rays.refraction')
+            closest_shape, closest_dist, face = self.closest_intersection(camera=camera, direction=direction)
+
+            if closest_shape is None:
+                return color + self.background_color.vector_on_scalar_mult(weight)
+
+            point = camera.madd(direction, closest_dist)
+            normal: Point = closest_shape.face_normal(point, face)
+            material: Material = closest_shape.material
+
+            diffuse, specular = self.lighting(point=point, normal=normal, direction=direction,
+                                              material=closest_shape.material)
+
+            # color + (цвет * diffuse + specular) * weight покомпонентно, без промежуточных векторов
+            base: Point = closest_shape.get_color(point)
+            color = Point(color.x + (base.x * diffuse + specular) * weight,
+                          color.y + (base.y * diffuse + specular) * weight,
+                          color.z + (base.z * diffuse + specular) * weight)
+
+            weight *= material.transparency
+            if weight <= self.min_weight:
+                break
+
+            refract_direction = self.refract(direction, normal, material.refractive)
+            if refract_direction is None:
+                refract_direction = self.reflect(direction, normal)
+            camera, direction = point, refract_direction
+
+        return color
+
+    def refract(self, direction: Point, normal: Point, ior: float):
+        """ направление преломлённого луча; None при полном внутреннем отражении """
+        scalar = direction.x * normal.x + direction.y * normal.y + direction.z * normal.z
+        if scalar > 0:
+            scalar = -scalar
+        a = 1 / ior
+        D = 1 - a * a * (1 - scalar * scalar)
+        if D > 0:
+            b = scalar * a + math.sqrt(D)
+            return Point(direction.x * a - direction.x * b, direction.y * a - direction.y * b,
+                         direction.z * a - direction.z * b)
+
+    def reflect(self, direction: Point, normal: Point) -> Point:
+        return direction.madd(normal, -(2 * (direction * normal)))
+
+    def reflect_batch(self, directions: np.ndarray, normals: np.ndarray) -> np.ndarray:
+        return directions - normals * (2 * dot_rows(directions, normals))[:, None]
+
+    def refract_batch(self, directions: np.ndarray, normals: np.ndarray, ior: np.ndarray) \
+            -> (np.ndarray, np.ndarray):
+        """ пакетный refract: новые направления и маска лучей, для которых преломление существует """
+        scalar = dot_rows(directions, normals)
+        scalar = np.where(scalar > 0, -scalar, scalar)
+        a = 1 / ior
+        D = 1 - a * a * (1 - scalar * scalar)
+        refracted = D > 0
+        b = scalar * a + np.sqrt(np.where(refracted, D, 0.))
+        return directions * a[:, None] - directions * b[:, None], refracted
+
+    def pixel_coordinates(self, indices: np.ndarray) -> (np.ndarray, np.ndarray):
+        """ координаты x, y на плоскости экрана для пикселей с номерами indices """
+        indices = np.asarray(indices)
+        x = (indices % self.width).astype(float) / self.size - 0.5
+        y = 0.5 - (indices.astype(float) / self.width) / self.size
+        return x, y
+
+    def pixel_directions(self, indices: np.ndarray) -> np.ndarray:
+        """ направления первичных лучей для пикселей с номерами indices без общей сетки """
+        x, y = self.pixel_coordinates(indices)
+        return normalize_rows(np.column_stack((x, y, np.ones(len(x)))))
+
+    def render_pixels(self, indices: np.ndarray) -> np.ndarray:
+        """ цвета пикселей с номерами indices массивом (N, 3) uint8 """
+        directions = self.directions[indices]
+        cameras = np.broadcast_to(self.camera.to_array(), directions.shape)
+        return colors_to_rgb(self.rays(cameras, directions, pixels=indices))
+
+    def tiles(self, tile_size: int) -> list:
+        """ разбиение кадра на плитки (x0, y0, x1, y1) """
+        return [(x0, y0, min(x0 + tile_size, self.width), min(y0 + tile_size, self.height))
+                for y0 in range(0, self.height, tile_size)
+                for x0 in range(0, self.width, tile_size)]
+
+    def render_tile(self, tile: tuple) -> np.ndarray:
+        """ плитка кадра массивом (y1 - y0, x1 - x0, 3) uint8 """
+        x0, y0, x1, y1 = tile
+        rows, columns = np.mgrid[y0:y1, x0:x1]
+        indices = (rows * self.width + columns).ravel()
+        return self.render_pixels(indices).reshape(y1 - y0, x1 - x0, 3)
+
+    def trace(self, workers: int = 1, tile_size: int = 32) -> np.ndarray:
+        """
+        Трассировка кадра в self.framebuffer. При workers > 1 плитки раздаются
+        пулу процессов: сцена передаётся каждому процессу один раз при его запуске,
+        а плитки забираются свободными процессами по одной, так что дорогие участки
+        не задерживают остальных. Результат совпадает с однопроцессным.
+        """
+        with stats.phase('trace'):
+            if workers > 1:
+                self.gbuffer = None
+                for (x0, y0, x1, y1), rgb in self.render_tiles(tile_size=tile_size, workers=workers):
+                    self.framebuffer[y0:y1, x0:x1] = rgb
+            else:
+                cameras = np.broadcast_to(self.camera.to_array(), self.directions.shape)
+                self.gbuffer = GBuffer(self.gbuffer_key()) if self.keep_gbuffer else None
+                self.buffer[:] = colors_to_rgb(self.rays(cameras, self.directions, self.gbuffer))
+
+        return self.framebuffer
+
+    def gbuffer_key(self) -> tuple:
+        """
+        То, от чего зависит геометрия кадра: камера, размер, ограничения путей, фигуры
+        и преломляющие свойства их материалов. Перемещение самих фигур ключ не замечает,
+        как и BVH: после него нужен обычный trace.
+        """
+        return ((self.camera.x, self.camera.y, self.camera.z), self.width, self.height,
+                self.max_depth, self.min_weight,
+                tuple((id(shape), shape.material.transparency, shape.material.refractive) for shape in self.shapes))
+
+    def relight(self) -> np.ndarray:
+        """
+        Пересчёт кадра после изменения источников света, фона или diffuse, albedo и specular
+        материалов: по G-буферу прошлого кадра заново считаются только освещение и цвета точек.
+        Если G-буфера нет или геометрия успела поменяться, выполняется обычный trace.
+        """
+        if self.gbuffer is None or self.gbuffer.key != self.gbuffer_key():
+            keep_gbuffer, self.keep_gbuffer = self.keep_gbuffer, True
+            try:
+                return self.trace()
+            finally:
+                self.keep_gbuffer = keep_gbuffer
+
+        with stats.phase('relight'):
+            colors = np.zeros((self.width * self.height, 3))
+            background = self.background_color.to_array()
+            # тот же порядок сложения, что и в rays: на каждой глубине сначала фон, потом попадания
+            for depth, (indices, weights) in enumerate(self.gbuffer.missed):
+                colors[indices] += weights[:, None] * background
+                if depth < len(self.gbuffer.surfaces):
+                    surface: Surface = self.gbuffer.surfaces[depth]
+                    colors[surface.indices] += surface.weights[:, None] * self.shade(
+                        surface.shape_ids, surface.points, surface.normals, surface.directions,
+                        self.light_keys(surface.indices, depth))
+            self.buffer[:] = colors_to_rgb(colors)
+
+        return self.framebuffer
+
+    def progressive(self, steps: tuple = PREVIEW_STEPS, chunk_size: int = 4096):
+        """
+        Постепенный рендер в self.framebuffer: сначала каждый steps[0]-й пиксель по обеим осям,
+        затем всё более частые сетки. Уже посчитанные пиксели не пересчитываются; после каждого
+        прохода кадр растягивается из посчитанных пикселей блоками step x step и готов к показу.
+        Генератор отдаёт (step, проход_закончен) после каждой порции из chunk_size пикселей,
+        так что остановить его можно и посреди прохода.
+        """
+        rows, columns = np.divmod(np.arange(self.width * self.height), self.width)
+        done = np.zeros(self.width * self.height, dtype=bool)
+
+        for step in steps:
+            on_grid = (rows % step == 0) & (columns % step == 0)
+            indices = np.flatnonzero(on_grid & ~done)
+            for start in range(0, len(indices), chunk_size):
+                chunk = indices[start:start + chunk_size]
+                self.buffer[chunk] = self.render_pixels(chunk)
+                yield step, False
+            done |= on_grid
+
+            if step > 1:
+                ys = np.arange(self.height) // step * step
+                xs = np.arange(self.width) // step * step
+                self.framebuffer[:] = self.framebuffer[ys[:, None], xs]
+            yield step, True
+
+    def render_band(self, y0: int, y1: int) -> np.ndarray:
+        """ строки y0..y1 кадра массивом (y1 - y0, width, 3) uint8; направления считаются только для них """
+        indices = np.arange(y0 * self.width, y1 * self.width)
+        directions = self.pixel_directions(indices)
+        cameras = np.broadcast_to(self.camera.to_array(), directions.shape)
+        return colors_to_rgb(self.rays(cameras, directions, pixels=indices)).reshape(y1 - y0, self.width, 3)
+
+    def render_bands(self, band_height: int = 16, workers: int = 1):
+        """
+        Генератор полос кадра (y0, y1, rgb) строго сверху вниз, без общей сетки лучей и без кадра
+        в памяти: готовые полосы можно сразу писать в поток (image_io.open_image_stream).
+        При workers > 1 в работе одновременно не больше 2 * workers полос, так что память
+        ограничена высотой полосы, а не размером кадра.
+        """
+        bands = [(y0, min(y0 + band_height, self.height)) for y0 in range(0, self.height, band_height)]
+        if workers <= 1:
+            for y0, y1 in bands:
+                yield y0, y1, self.render_band(y0, y1)
+            return
+
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_tile_worker,
+                                       initargs=(self, stats.enabled))
+        pending = deque()  # ((y0, y1), future) в порядке полос
+
+        def finished():
+            (y0, y1), future = pending.popleft()
+            rgb, band_stats = future.result()
+            if band_stats is not None:
+                stats.merge(band_stats)
+            return y0, y1, rgb
+
+        try:
+            for band in bands:
+                pending.append((band, executor.submit(render_band_in_worker, band)))
+                if len(pending) >= 2 * workers:
+                    yield finished()
+            while pending:
+                yield finished()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def render_tiles(self, tile_size: int = 32, workers: int = 1):
+        """ генератор готовых плиток (tile, rgb) в порядке их готовности """
+        tiles = self.tiles(tile_size)
+        if workers <= 1:
+            for tile in tiles:
+                yield tile, self.render_tile(tile)
+            return
+
+        executor = ProcessPoolExecutor(max_workers=min(workers, len(tiles)) or 1,
+                                       initializer=init_tile_worker, initargs=(self, stats.enabled))
+        try:
+            futures = {executor.submit(render_tile_in_worker, tile): tile for tile in tiles}
+            for future in as_completed(futures):
+                rgb, tile_stats = future.result()
+                if tile_stats is not None:
+                    stats.merge(tile_stats)
+                yield futures[future], rgb
+        finally:
+            # при досрочной остановке генератора невыполненные плитки отменяются
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def __getstate__(self):
+        # в процессы пула уходит только сцена, без результатов прошлых кадров
+        state = self.__dict__.copy()
+        state['framebuffer'] = np.zeros((0, 0, 3), dtype=np.uint8)
+        state['grid'] = None
+        state['gbuffer'] = None
+        return state
+
+    def subpixel_samples(self, pixels: np.ndarray, offsets: np.ndarray) -> (np.ndarray, np.ndarray):
+        """
+        Цвета (обрезанные до [0, 1]) и номера задетых первичными лучами фигур (-1 при промахе)
+        для лучей через точки offsets (доли пикселя, (K, 2)) каждого из pixels: массивы (P, K, 3) и (P, K)
+        """
+        x, y = self.pixel_coordinates(pixels)
+        x = (x[:, None] + offsets[:, 0] / self.size).ravel()
+        y = (y[:, None] - offsets[:, 1] / self.size).ravel()
+        directions = normalize_rows(np.column_stack((x, y, np.ones(len(x)))))
+        cameras = np.broadcast_to(self.camera.to_array(), directions.shape)
+
+        gbuffer = GBuffer(None)
+        colors = np.clip(np.nan_to_num(self.rays(cameras, directions, gbuffer)), 0, 1)
+        shape_ids = np.full(len(directions), -1)
+        if gbuffer.surfaces:
+            shape_ids[gbuffer.surfaces[0].indices] = gbuffer.surfaces[0].shape_ids
+        return colors.reshape(len(pixels), len(offsets), 3), shape_ids.reshape(len(pixels), len(offsets))
+
+    def trace_adaptive(self, threshold: float = 0.1, max_samples: int = 16) -> (np.ndarray, int):
+        """
+        Трассировка с адаптивным сглаживанием: сначала луч на пиксель, затем пиксели, у которых
+        цвет соседа справа или снизу отличается больше чем на threshold (по любому каналу, в долях
+        от 1) или задета другая фигура, досчитываются по сетке 2 x 2 точек внутри пикселя, а те,
+        у которых и эти точки расходятся, - по сетке 4 x 4 и так далее, пока число точек не
+        превысит max_samples. Точки грубой сетки входят в более частую и не пересчитываются.
+        Возвращает кадр и число дополнительных лучей (по одному на точку, без теневых и преломлённых).
+        """
+        count = self.width * self.height
+        colors, shape_ids = self.subpixel_samples(np.arange(count), np.zeros((1, 2)))
+        colors, shape_ids = colors[:, 0], shape_ids[:, 0]
+
+        image = colors.reshape(self.height, self.width, 3)
+        ids = shape_ids.reshape(self.height, self.width)
+        edges = np.zeros((self.height, self.width), dtype=bool)
+        for axis in (0, 1):
+            first = [slice(None), slice(None)]
+            second = [slice(None), slice(None)]
+            first[axis], second[axis] = slice(None, -1), slice(1, None)
+            first, second = tuple(first), tuple(second)
+            contrast = (np.abs(image[first] - image[second]).max(axis=2) > threshold) | (ids[first] != ids[second])
+            edges[first] |= contrast
+            edges[second] |= contrast
+
+        sums = colors.copy()
+        samples = np.ones(count)
+        pixels = np.flatnonzero(edges.ravel())
+        lowest, highest, first_ids = colors[pixels], colors[pixels], shape_ids[pixels]
+        mixed = np.zeros(len(pixels), dtype=bool)
+        extra_rays = 0
+
+        size = 2
+        while size * size <= max_samples and pixels.size:
+            grid = np.array([(i, j) for j in range(size) for i in range(size) if i % 2 or j % 2]) / size
+            new_colors, new_ids = self.subpixel_samples(pixels, grid)
+            extra_rays += new_ids.size
+
+            sums[pixels] += new_colors.sum(axis=1)
+            samples[pixels] += len(grid)
+            lowest = np.minimum(lowest, new_colors.min(axis=1))
+            highest = np.maximum(highest, new_colors.max(axis=1))
+            mixed |= (new_ids != first_ids[:, None]).any(axis=1)
+
+            # дальше уточняются только пиксели, точки внутри которых всё ещё расходятся
+            again = mixed | ((highest - lowest).max(axis=1) > threshold)
+            pixels, lowest, highest, first_ids, mixed = \
+                pixels[again], lowest[again], highest[again], first_ids[again], mixed[again]
+            size *= 2
+
+        if stats.enabled:
+            stats.count('rays.antialias', extra_rays)
+        self.buffer[:] = (255 * (sums / samples[:, None])).astype(np.uint8)
+        return self.framebuffer, extra_rays
+
+    def trace_scalar(self) -> np.ndarray:
+        """ поточечная трассировка без векторизации, эталон для пакетного trace """
+        ray_count = self.width * self.height
+        buffer = self.buffer
+        xs, ys = self.x.tolist(), self.y.tolist()
+
+        with stats.phase('trace'):
+            for i in range(ray_count):
+                p: Point = Point(xs[i], ys[i], 1)
+                direction: Point = p.normalize()
+                color: Point = self.ray(camera=self.camera, direction=direction)
+
+                buffer[i] = color.to_rgb()
+
+        return self.framebuffer
+
+    def build_bitmap(self) -> list:
+        columns = self.buffer.reshape(self.width, self.height, 3).tolist()
+        return [[tuple(color) for color in column] for column in columns]
+
+
+# Трассировщик процесса пула, получаемый один раз при запуске процесса
+worker_tracer: Tracer = None
+
+
+def init_tile_worker(tracer: Tracer, collect_stats: bool = False):
+    global worker_tracer
+    worker_tracer = tracer
+    if collect_stats:
+        stats.enable()
+    else:
+        stats.disable()
+
+
+def render_tile_in_worker(tile: tuple) -> (np.ndarray, dict):
+    """ плитка и собранная на ней статистика (None, если сбор выключен) для слияния в главном процессе """
+    if not stats.enabled:
+        return worker_tracer.render_tile(tile), None
+    stats.reset()
+    return worker_tracer.render_tile(tile), stats.as_dict()
+
+
+def render_band_in_worker(band: tuple) -> (np.ndarray, dict):
+    if not stats.enabled:
+        return worker_tracer.render_band(*band), None
+    stats.reset()
+    return worker_tracer.render_band(*band), stats.as_dict()
+
+
+class Sphere(Shape):
+    def __init__(self, center: Point, radius: float, material: Material, eps: float = 0.0001):
+        self.eps = eps
+        self.center = center
+        self.radius = radius
+        self.material = material
+
+    def does_ray_intersect(self, camera: Point, direction: Point):
+        center = self.center
+        x, y, z = camera.x - center.x, camera.y - center.y, camera.z - center.z
+
+        b = x * direction.x + y * direction.y + z * direction.z
+        c = x * x + y * y + z * z - self.radius * self.radius
+        discriminant = b * b - c
+        if discriminant < self.eps:
+            res = np.inf
+            return False, res
+        root = math.sqrt(discriminant)
+        res = -b - root
+        if res < self.eps:
+            res = -b + root
+
+        return res > self.eps, res
+
+    def does_rays_intersect(self, cameras: np.ndarray, directions: np.ndarray) -> (np.ndarray, np.ndarray):
+        intersection_points = cameras - self.center.to_array()
+
+        b = dot_rows(intersection_points, directions)
+        c = dot_rows(intersection_points, intersection_points) - self.radius * self.radius
+        discriminant = b * b - c
+        hit = discriminant >= self.eps
+        root = np.sqrt(np.where(hit, discriminant, 0.))
+        res = -b - root
+        res = np.where(res < self.eps, -b + root, res)
+
+        return np.where(hit & (res > self.eps), res, np.inf), np.zeros(len(directions), dtype=int)
+
+    def normal(self, point: Point):
+        return (point - self.center).normalize()
+
+    def normals(self, points: np.ndarray, faces: np.ndarray) -> np.ndarray:
+        return normalize_rows(points - self.center.to_array())
+
+    def bounds(self) -> (np.ndarray, np.ndarray):
+        center = self.center.to_array()
+        return center - self.radius, center + self.radius
+
+
+class TriangleMesh(Shape):
+    """
+    Набор треугольников в плоских массивах: вершина v0, рёбра edge1, edge2 и нормали
+    граней считаются один раз при построении и дальше только читаются.
+    Для больших наборов строится собственная BVH по треугольникам.
+    """
+    # до такого числа треугольников все грани проверяются разом, без BVH
+    BRUTE_FORCE_FACES = 8
+
+    def __init__(self, vertices, faces, material: Material, normals=None, eps: float = 0.0001, bvh: BVH = None):
+        self.eps = eps
+        self.material = material
+        self.vertices = np.ascontiguousarray(vertices, dtype=float).reshape(-1, 3)
+        self.faces = np.ascontiguousarray(faces, dtype=np.int64).reshape(-1, 3)
+
+        corners = self.vertices[self.faces]
+        self.v0 = np.ascontiguousarray(corners[:, 0])
+        self.edge1 = np.ascontiguousarray(corners[:, 1] - corners[:, 0])
+        self.edge2 = np.ascontiguousarray(corners[:, 2] - corners[:, 0])
+        if normals is None:
+            # без порога normalize_rows: у мелких граней сканов векторное произведение меньше 0.0001
+            normals = cross_rows(self.edge1, self.edge2)
+            lengths = np.sqrt(dot_rows(normals, normals))
+            normals = normals / np.where(lengths > 0, lengths, 1.)[:, None]
+        self.face_normals = np.ascontiguousarray(np.broadcast_to(normals, self.v0.shape), dtype=float)
+
+        self._triangles: list = None
+
+        # готовую BVH по тем же треугольникам можно передать, например из кэша сетки
+        self.bvh: BVH = bvh
+        if bvh is None and len(self.faces) > self.BRUTE_FORCE_FACES:
+            self.bvh = BVH(corners.min(axis=1), corners.max(axis=1))
+
+    def __len__(self):
+        return len(self.faces)
+
+    @property
+    def triangles(self) -> list:
+        """ те же данные обычными числами для поточечной трассировки; строятся при первом обращении """
+        if self._triangles is None:
+            self._triangles = list(zip(self.v0.tolist(), self.edge1.tolist(), self.edge2.tolist()))
+        return self._triangles
+
+    def ray_intersects_triangle(self, camera: Point, direction: Point, face: int) -> float:
+        """ расстояние до треугольника face, np.inf при промахе """
+        (p0x, p0y, p0z), (e1x, e1y, e1z), (e2x, e2y, e2z) = self.triangles[face]
+        dx, dy, dz = direction.x, direction.y, direction.z
+
+        hx, hy, hz = dy * e2z - dz * e2y, dz * e2x - dx * e2z, dx * e2y - dy * e2x
+        a = e1x * hx + e1y * hy + e1z * hz
+        if -self.eps < a < self.eps:
+            return np.inf
+
+        f = 1. / a
+
+        sx, sy, sz = camera.x - p0x, camera.y - p0y, camera.z - p0z
+        u = (sx * hx + sy * hy + sz * hz) * f
+        if u < 0 or u > 1:
+            return np.inf
+
+        qx, qy, qz = sy * e1z - sz * e1y, sz * e1x - sx * e1z, sx * e1y - sy * e1x
+        v = (dx * qx + dy * qy + dz * qz) * f
+        if v < 0 or v + u > 1:
+            return np.inf
+
+        t = (e2x * qx + e2y * qy + e2z * qz) * f
+        return t if t > self.eps else np.inf
+
+    def does_ray_intersect(self, camera: Point, direction: Point) -> (bool, float):
+        hit, intersect, _ = self.does_ray_intersect_face(camera, direction)
+        return hit, intersect
+
+    def does_ray_intersect_face(self, camera: Point, direction: Point) -> (bool, float, int):
+        if self.bvh is not None:
+            def test(face: int) -> float:
+                if stats.enabled:
+                    stats.count('tests.triangles')
+                return self.ray_intersects_triangle(camera, direction, face)
+
+            face, intersect = self.bvh.closest((camera.x, camera.y, camera.z),
+                                               (direction.x, direction.y, direction.z), test, 0., np.inf)
+        else:
+            if stats.enabled:
+                stats.count('tests.triangles', len(self))
+            # при равных расстояниях - грань с меньшим номером, как в пакетном argmin
+            intersect, face = min((self.ray_intersects_triangle(camera, direction, face), face)
+                                  for face in range(len(self)))
+        return intersect != np.inf, intersect, face
+
+    def does_rays_intersect(self, cameras: np.ndarray, directions: np.ndarray) -> (np.ndarray, np.ndarray):
+        if self.bvh is not None:
+            def intersect(face: int, rays: np.ndarray):
+                if stats.enabled:
+                    stats.count('tests.triangles', len(rays))
+                t = rays_intersect_triangles(cameras[rays], directions[rays], self.v0[face:face + 1],
+                                             self.edge1[face:face + 1], self.edge2[face:face + 1], self.eps)[:, 0]
+                return t, np.full(len(rays), face)
+
+            faces, t, _ = self.bvh.closest_batch(cameras, directions, intersect, 0., np.inf)
+            return t, faces
+
+        if stats.enabled:
+            stats.count('tests.triangles', len(directions) * len(self))
+        t = rays_intersect_triangles(cameras, directions, self.v0, self.edge1, self.edge2, self.eps)
+        faces = np.argmin(t, axis=1)
+        return t[np.arange(len(t)), faces], faces
+
+    def face_at(self, point: Point) -> int:
+        """
+        грань, на которой лежит точка (ближайшая по расстоянию до плоскости) - только
+        для normal без номера грани; трассировка берёт грань из does_ray_intersect_face
+        """
+        s = point.to_array() - self.v0
+        distance = np.abs(dot_rows(s, self.face_normals))
+        return int(np.argmin(distance))
+
+    def normal(self, point: Point) -> Point:
+        return Point(*self.face_normals[self.face_at(point)])
+
+    def face_normal(self, point: Point, face: int) -> Point:
+        return Point(*self.face_normals[face])
+
+    def normals(self, points: np.ndarray, faces: np.ndarray) -> np.ndarray:
+        return self.face_normals[faces]
+
+    def bounds(self) -> (np.ndarray, np.ndarray):
+        return self.vertices.min(axis=0), self.vertices.max(axis=0)
+
+    def key_data(self) -> list:
+        # рёбра, треугольники и BVH выводятся из вершин и граней
+        return [self.vertices, self.faces, self.face_normals, self.eps, self.material]
+
+
+class Side(TriangleMesh):
+    def __init__(self, points: list, material: Material, norm: Point, eps: float = 0.0001):
+        self.points = list()
+        for p in points:
+            self.points.append(Point(p.x, p.y, p.z))
+        self.norm = Point(norm.x, norm.y, norm.z)
+        super().__init__(vertices=[p.to_array() for p in self.points], faces=[(0, 1, 3), (1, 2, 3)],
+                         material=material, normals=self.norm.to_array(), eps=eps)
+
+    def normal(self, point: Point) -> Point:
+        return self.norm
+
+
+class TetrahedronSide(TriangleMesh):
+    def __init__(self, points: list(), material: Material, eps: float = 0.0001):
+        self.points = list()
+        for p in points:
+            self.points.append(Point(p.x, p.y, p.z))
+        self.norm = self.calc_normal()
+        super().__init__(vertices=[p.to_array() for p in self.points], faces=[(0, 1, 2)],
+                         material=material, normals=self.norm.to_array(), eps=eps)
+
+    def normal(self, point: Point) -> Point:
+        return self.norm
+
+    def calc_normal(self) -> Point:
+        point1, point2, point3 = self.points
+        vx1 = point1.x - point2.x
+        vy1 = point1.y - point2.y
+        vz1 = point1.z - point2.z
+
+        vx2 = point2.x - point3.x
+        vy2 = point2.y - point3.y
+        vz2 = point2.z - point3.z
+        wrki = math.sqrt(sqr(vy1 * vz2 - vz1 * vy2) + sqr(vz1 * vx2 - vx1 * vz2) + sqr(vx1 * vy2 - vy1 * vx2))
+        nx = (vy1 * vz2 - vz1 * vy2) / wrki
+        ny = (vz1 * vx2 - vx1 * vz2) / wrki
+        nz = (vx1 * vy2 - vy1 * vx2) / wrki
+        return Point(nx, ny, nz)
+
+
+class Light:
+    def __init__(self, intensity: float, position: Point):
+        self.intensity = intensity
+        self.position = position
+
+    def key_data(self) -> list:
+        return [self.intensity, self.position]
+
+
+def sqr(a):
+    return a * a
+
+
+def build_scene(sphere: Sphere, tetrahedron_points: list) -> (list, list):
+    """ сцена окна: комната из пяти стен, шар и тетраэдр; возвращает фигуры и источники света """
+    lights = [Light(intensity=0.8, position=Point(0, 0.4, 1))]
+    tetrahedron = list(itertools.combinations(tetrahedron_points, 3))
+    tetrahedron_sides = [TetrahedronSide(side, yellow) for side in tetrahedron]
+
+    shapes = [
+        Side([Point(-0.5, -0.5, 4.5),
+              Point(-0.5, 0.5, 4.5),
+              Point(-0.5, 0.5, -4.5),
+              Point(-0.5, -0.5, -4.5)],
+             material=white,
+             norm=Point(1, 0, 0)),
+
+        Side([Point(0.5, -0.5, 4.5),
+              Point(0.5, 0.5, 4.5),
+              Point(0.5, 0.5, -4.5),
+              Point(0.5, -0.5, -4.5)],
+             material=white,
+             norm=Point(-1, 0, 0)),
+
+        Side([Point(0.5, -0.5, 4.5),
+              Point(-0.5, -0.5, 4.5),
+              Point(-0.5, -0.5, -4.5),
+              Point(0.5, -0.5, -4.5)],
+             material=red,
+             norm=Point(0, 1, 0)),
+
+        Side([Point(0.5, 0.5, 4.5),
+              Point(-0.5, 0.5, 4.5),
+              Point(-0.5, 0.5, -4.5),
+              Point(0.5, 0.5, -4.5)],
+             material=blue,
+             norm=Point(0, -1, 0)),
+
+        Side([Point(0.5, 0.5, 3),
+              Point(-0.5, 0.5, 3),
+              Point(-0.5, -0.5, 3),
+              Point(0.5, -0.5, 3)],
+             material=gray,
+             norm=Point(0, 0, -1)),
+        sphere,
+        *tetrahedron_sides
+    ]
+
+    return shapes, lights
+
+
+def demo_objects() -> (Sphere, list):
+    """ шар и вершины тетраэдра демонстрационной сцены """
+    tetrahedron_points = [
+        Point(0.5, 0.0, 1.5),
+        Point(0.5, -0.3, 1.8),
+        Point(-0.1, -0.1, 1.5),
+        Point(0.5, 0.2, 2)
+    ]
+    sphere = Sphere(Point(0.3, 0.2, 1), 0.1, green)
+    return sphere, tetrahedron_points
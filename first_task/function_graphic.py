@@ -1,21 +1,249 @@
+import ast
+import asyncio
+import math
+import queue
 import sys
+import time
+from collections import OrderedDict, deque
 
 from PyQt5.QtWidgets import QWidget, QApplication
-from PyQt5.QtGui import QPainter
-from PyQt5.QtCore import QPoint
-import math
+from PyQt5.QtGui import QPainter, QPixmap, QPolygonF
+from PyQt5.QtCore import QLineF, QRect, QTimer, Qt
+import numpy as np
 
 
 def f(x):
-    return x * math.sin(x * x)
+    return x * np.sin(x * x)
 
 
 a, b = -5, 5
 
 
+# огибающая: отсчётов на столбец пикселей при первом проходе и не больше чем
+ENVELOPE_SAMPLES = 4
+ENVELOPE_MAX_SAMPLES = 1024
+
+# имена, доступные в выражении, кроме x
+EXPRESSION_NAMES = {name: getattr(np, name) for name in (
+    'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan', 'sinh', 'cosh', 'tanh', 'exp', 'log', 'log2', 'log10',
+    'sqrt', 'abs', 'sign', 'floor', 'ceil', 'minimum', 'maximum', 'hypot', 'where', 'pi', 'e')}
+
+# узлы разбора, допустимые в выражении: арифметика, сравнения, числа, имена и вызовы по имени;
+# атрибуты, лямбды, генераторы, индексы и строки отвергаются, как и условие a if c else b и цепочки
+# сравнений 0 < x < 1: на массиве они не считаются (вместо них - where и (0 < x) & (x < 1))
+EXPRESSION_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Load,
+                    ast.Constant, ast.operator, ast.unaryop, ast.cmpop)
+
+# интервалов в плитке пирамиды, плиток в памяти и интервалов на столбец пикселей
+TILE_SAMPLES = 256
+MAX_TILES = 256
+TILE_OVERSAMPLING = 4
+
+# допустимая ширина [a, b] при масштабировании колесом
+ZOOM_LIMITS = (1e-9, 1e9)
+ZOOM_STEP = 0.8
+
+# поток: отсчётов в окне, кадров в секунду и частота отсчётов демонстрационного источника
+STREAM_CAPACITY = 50000
+STREAM_FPS = 60
+TELEMETRY_RATE = 10000
+
+
+def sample(func, xs: np.ndarray) -> np.ndarray:
+    """ значения функции на всём массиве xs за один вызов; функции только для чисел считаются поточечно """
+    try:
+        ys = np.asarray(func(xs), dtype=float)
+    except (TypeError, ValueError):
+        ys = None
+    if ys is None or ys.shape != xs.shape:
+        ys = np.array([func(x) for x in xs.ravel()], dtype=float).reshape(xs.shape)
+    return ys
+
+
+def required_samples(ys: np.ndarray, width: float, tolerance: float) -> np.ndarray:
+    """
+    Сколько отсчётов нужно столбцу, чтобы между ними не потерялся экстремум
+    больше tolerance: ошибка ломаной около f''h^2/8, вторая производная
+    оценивается по вторым разностям уже посчитанных отсчётов.
+    """
+    n = ys.shape[1] - 1
+    curvature = np.abs(ys[:, :-2] - 2 * ys[:, 1:-1] + ys[:, 2:]) * (n / width) ** 2
+    curvature = np.nan_to_num(np.fmax.reduce(curvature, axis=1), nan=0.)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        return np.ceil(width * np.sqrt(curvature / (8 * tolerance)))
+
+
+def envelope(func, a: float, b: float, columns: int, rows: int = 500,
+             samples: int = ENVELOPE_SAMPLES, max_samples: int = ENVELOPE_MAX_SAMPLES):
+    """
+    Огибающая M4: первое, последнее, наименьшее и наибольшее значение func в
+    каждом из columns столбцов [a, b]. Столбцы, где функция круто изгибается,
+    досчитываются с удвоением числа отсчётов, пока ошибка не станет меньше
+    полупикселя (пиксель - 1/rows размаха значений после первого прохода)
+    или отсчётов не станет max_samples. Оценка столбца - наибольшая из его
+    и двух соседних: редкие отсчёты частых колебаний могут случайно лечь
+    почти на прямую. Каждый проход - один векторный вызов func по всем
+    столбцам, которым ещё не хватает отсчётов.
+    Соседние столбцы делят граничную точку, поэтому last[i] == first[i + 1].
+    """
+    width = (b - a) / columns
+    first, last, low, high = (np.full(columns, np.nan) for _ in range(4))
+    needed = np.zeros(columns)
+    active = np.arange(columns)
+    n = samples
+    tolerance = None
+    while len(active):
+        xs = a + (active[:, None] + np.arange(n + 1) / n) * width
+        ys = sample(func, xs)
+        first[active], last[active] = ys[:, 0], ys[:, -1]
+        low[active], high[active] = np.fmin.reduce(ys, axis=1), np.fmax.reduce(ys, axis=1)
+
+        if n >= max_samples:
+            break
+        if tolerance is None:
+            tolerance = (np.nanmax(high) - np.nanmin(low)) / rows / 2 or 1.
+        needed[active] = required_samples(ys, width, tolerance)
+        local = needed.copy()
+        local[1:] = np.maximum(local[1:], needed[:-1])
+        local[:-1] = np.maximum(local[:-1], needed[1:])
+        active = np.flatnonzero(local > n)
+        n = min(n * 2, max_samples)
+
+    return first, last, low, high
+
+
+def compile_expression(text: str):
+    """
+    Выражение от x (например 'x * sin(x * x)') как функция, считающая его
+    сразу на массиве numpy. Разбирается один раз; доступны x и EXPRESSION_NAMES,
+    а разбор проверяется целиком (EXPRESSION_NODES), включая вложенные выражения.
+    Затем функция один раз считается на небольшом массиве только для чтения, так
+    что выражения, которые не считаются на массиве целиком (например sin(x, x)),
+    отвергаются здесь, а не при рисовании.
+    """
+    tree = ast.parse(text, '<expression>', 'eval')
+    for node in ast.walk(tree):
+        if isinstance(node, ast.IfExp):
+            raise ValueError('Use where(condition, a, b) instead of "a if condition else b"')
+        if isinstance(node, ast.Compare) and len(node.ops) > 1:
+            raise ValueError('Chained comparisons are not supported, use (0 < x) & (x < 1) instead of 0 < x < 1')
+        if not isinstance(node, EXPRESSION_NODES):
+            raise ValueError('Unsupported syntax in expression: {}'.format(type(node).__name__))
+        if isinstance(node, ast.Name) and node.id not in EXPRESSION_NAMES and node.id != 'x':
+            raise ValueError('Unknown name in expression: {}'.format(node.id))
+        if isinstance(node, ast.Call) and not isinstance(node.func, ast.Name):
+            raise ValueError('Only functions from EXPRESSION_NAMES can be called')
+        if isinstance(node, ast.Constant) and type(node.value) not in (int, float, complex):
+            raise ValueError('Unsupported constant in expression: {!r}'.format(node.value))
+    code = compile(tree, '<expression>', 'eval')
+
+    def func(x):
+        with np.errstate(all='ignore'):
+            y = eval(code, {'__builtins__': {}}, dict(EXPRESSION_NAMES, x=x))
+        return np.broadcast_to(np.asarray(y, dtype=float), np.shape(x))
+
+    xs = np.linspace(-1., 1., 5)
+    xs.flags.writeable = False
+    try:
+        func(xs)
+    except (TypeError, ValueError, ArithmeticError) as error:
+        raise ValueError('Expression cannot be computed on an array of x: {}'.format(error)) from error
+    return func
+
+
+class SamplePyramid:
+    """
+    Огибающие функции, посчитанные плитками разного разрешения. Плитка
+    (уровень, номер) - TILE_SAMPLES интервалов ширины 2^уровень, начиная с
+    x = номер * TILE_SAMPLES * 2^уровень; для каждого интервала хранятся
+    наименьшее и наибольшее значение функции (см. envelope). Вид [a, b]
+    собирается из плиток уровня, у которого на столбец пикселей приходится
+    не меньше oversampling интервалов, поэтому сдвиг или масштаб считает
+    только плитки, которых ещё нет.
+    Давно не использованные плитки вытесняются, когда их больше max_tiles.
+    """
+
+    def __init__(self, func, tile_samples: int = TILE_SAMPLES, max_tiles: int = MAX_TILES,
+                 oversampling: int = TILE_OVERSAMPLING, rows: int = 1000):
+        self.func = func
+        self.tile_samples = tile_samples
+        self.max_tiles = max_tiles
+        self.oversampling = oversampling
+        self.rows = rows
+        self.tiles = OrderedDict()
+        self.evaluated = 0
+
+    def tile(self, level: int, index: int) -> np.ndarray:
+        """ наименьшие и наибольшие значения (2, tile_samples) по интервалам плитки """
+        key = (level, index)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+
+        span = self.tile_samples * 2. ** level
+        _, _, low, high = envelope(self.func, index * span, (index + 1) * span, self.tile_samples, self.rows)
+        tile = self.tiles[key] = np.stack((low, high))
+        self.evaluated += 1
+        while len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+        return tile
+
+    def view(self, a: float, b: float, columns: int) -> (np.ndarray, np.ndarray):
+        """ наименьшее и наибольшее значение функции в каждом из columns столбцов [a, b] """
+        level = math.floor(math.log2((b - a) / columns / self.oversampling))
+        step = 2. ** level
+        span = self.tile_samples * step
+        first, last = math.floor(a / span), math.ceil(b / span)
+        tiles = np.concatenate([self.tile(level, index) for index in range(first, last)], axis=1)
+
+        # интервал уже столбца, так что задевает не больше двух соседних; он входит в оба,
+        # и отрезки соседних столбцов смыкаются
+        starts = first * span + np.arange(tiles.shape[1]) * step
+        low, high = np.full(columns, np.nan), np.full(columns, np.nan)
+        for edge in (starts, starts + step):
+            column = np.floor((edge - a) * columns / (b - a)).astype(int)
+            inside = (column >= 0) & (column < columns)
+            np.fmin.at(low, column[inside], tiles[0, inside])
+            np.fmax.at(high, column[inside], tiles[1, inside])
+        return low, high
+
+
+def value_axis(max_x: int, y0: float) -> list:
+    """ горизонтальная ось на высоте y0 со стрелкой вправо """
+    return [QLineF(0, y0, max_x, y0),
+            QLineF(max_x, y0, max_x - 10, y0 - 5),
+            QLineF(max_x, y0, max_x - 10, y0 + 5)]
+
+
+def polyline(xs: np.ndarray, ys: np.ndarray) -> QPolygonF:
+    """ QPolygonF, заполненный прямо из массивов, без QPointF на каждую точку """
+    polygon = QPolygonF(len(xs))
+    if len(xs):
+        pointer = polygon.data()
+        pointer.setsize(len(xs) * 2 * np.dtype(float).itemsize)
+        points = np.frombuffer(pointer, dtype=float).reshape(-1, 2)
+        points[:, 0] = xs
+        points[:, 1] = ys
+    return polygon
+
+
 class IndependentScaleGraph(QWidget):
-    def __init__(self):
+    def __init__(self, envelope: bool = False, expression: str = None):
         super().__init__()
+        self.a, self.b = a, b
+        # envelope: вместо одного отсчёта на столбец рисовать вертикальный отрезок от минимума до максимума f
+        self.envelope = envelope
+        # expression: рисовать не f, а выражение от x, отсчёты которого хранятся в пирамиде плиток
+        self.pyramid: SamplePyramid = None
+        if expression is not None:
+            self.pyramid = SamplePyramid(compile_expression(expression))
+            self.envelope = True
+        # положение мыши и [a, b] в начале перетаскивания
+        self.drag = None
+        # график и оси в экранных координатах; пересчитываются, только если изменились размер, [a, b] или режим
+        self.cache_key = None
+        self.curve: QPolygonF = None
+        self.axes: list = []
         self.init_ui()
 
     def init_ui(self):
@@ -23,39 +251,51 @@ class IndependentScaleGraph(QWidget):
         self.setWindowTitle('Function\'s Graphic. Independent Scale')
 
     def independent_scale(self, qp):
-        max_x = self.width()
-        max_y = self.height()
-        y_min = y_max = f(a)
-
-        for xx in range(max_x):
-            x = a + xx * (b - a) / max_x
-            y = f(x)
-            if y < y_min:
-                y_min = y
-            if y > y_max:
-                y_max = y
-
-        yy = (f(a) - y_min) * max_y / (y_max - y_min)
-        previous_point = QPoint(0, yy)
-
-        for xx in range(1, max_x):
-            x = a + xx * (b - a) / max_x
-            y = f(x)
-            yy = (y - y_max) * max_y / (y_min - y_max)
-            current_point = QPoint(xx, yy)
-            self.draw_lines(qp, previous_point, current_point)
-            previous_point = current_point
+        key = (self.width(), self.height(), self.a, self.b, self.envelope)
+        if key != self.cache_key:
+            self.cache_key = key
+            self.curve, self.axes = self.build_graph(*key)
 
+        if self.envelope:
+            qp.drawLines(self.curve)
+        else:
+            qp.drawPolyline(self.curve)
+        qp.drawLines(self.axes)
+
+    def build_graph(self, max_x: int, max_y: int, a: float, b: float, spans: bool = False) -> (QPolygonF, list):
+        """
+        Ломаная графика и отрезки осей со стрелками; f считается один раз на столбец пикселей.
+        С spans вместо ломаной - пары точек, по вертикальному отрезку на столбец.
+        """
+        xx = np.arange(max_x)
+        if spans:
+            if self.pyramid is not None:
+                low, high = self.pyramid.view(a, b, max_x)
+            else:
+                _, _, low, high = envelope(f, a, b, max_x, max_y)
+            y_min, y_max = np.nanmin(low), np.nanmax(high)
+        else:
+            ys = sample(f, a + xx * (b - a) / max_x)
+            y_min, y_max = np.nanmin(ys), np.nanmax(ys)
+        if y_min == y_max:
+            y_min, y_max = y_min - 1, y_max + 1
+
+        if spans:
+            # столбец x - отрезок (x, high) - (x, low); соседние отрезки смыкаются в общей граничной точке
+            ends = np.column_stack((high, low)).ravel()
+            curve = polyline(np.repeat(xx, 2), (ends - y_max) * max_y / (y_min - y_max))
+        else:
+            curve = polyline(xx, (ys - y_max) * max_y / (y_min - y_max))
+
+        axes = []
         if a <= 0:
-            xx = abs(a) * max_x / (b - a)
-            qp.drawLine(QPoint(xx, 0), QPoint(xx, max_y))
-            qp.drawLine(QPoint(xx, 0), QPoint(xx + 5, 10))
-            qp.drawLine(QPoint(xx, 0), QPoint(xx - 5, 10))
+            x0 = abs(a) * max_x / (b - a)
+            axes.append(QLineF(x0, 0, x0, max_y))
+            axes.append(QLineF(x0, 0, x0 + 5, 10))
+            axes.append(QLineF(x0, 0, x0 - 5, 10))
 
-        yy = (0 - y_max) * max_y / (y_min - y_max)
-        qp.drawLine(QPoint(0, yy), QPoint(max_x, yy))
-        qp.drawLine(QPoint(max_x, yy), QPoint(max_x - 10, yy - 5))
-        qp.drawLine(QPoint(max_x, yy), QPoint(max_x - 10, yy + 5))
+        axes.extend(value_axis(max_x, (0 - y_max) * max_y / (y_min - y_max)))
+        return curve, axes
 
     def paintEvent(self, e):
         qp = QPainter()
@@ -63,16 +303,275 @@ class IndependentScaleGraph(QWidget):
         self.independent_scale(qp)
         qp.end()
 
-    def draw_lines(self, qp, previous_point, current_point):
-        qp.drawLine(previous_point, current_point)
+    def wheelEvent(self, e):
+        """ масштаб колесом вокруг точки под курсором """
+        factor = ZOOM_STEP ** (e.angleDelta().y() / 120)
+        if not ZOOM_LIMITS[0] <= (self.b - self.a) * factor <= ZOOM_LIMITS[1]:
+            return
+        x = self.a + e.pos().x() * (self.b - self.a) / self.width()
+        self.a, self.b = x - (x - self.a) * factor, x + (self.b - x) * factor
+        self.update()
+
+    def mousePressEvent(self, e):
+        self.drag = (e.x(), self.a, self.b)
+
+    def mouseMoveEvent(self, e):
+        """ сдвиг [a, b] перетаскиванием """
+        if self.drag is None:
+            return
+        x, a0, b0 = self.drag
+        shift = (e.x() - x) * (b0 - a0) / self.width()
+        self.a, self.b = a0 - shift, b0 - shift
+        self.update()
+
+    def mouseReleaseEvent(self, e):
+        self.drag = None
+
+
+class RingBuffer:
+    """ последние capacity значений потока в массиве numpy; written - сколько записано за всё время """
+
+    def __init__(self, capacity: int, item_shape: tuple = ()):
+        self.capacity = capacity
+        self.data = np.zeros((capacity,) + item_shape)
+        self.written = 0
+
+    def extend(self, values: np.ndarray):
+        values = values[-self.capacity:]
+        start = self.written % self.capacity
+        head = min(len(values), self.capacity - start)
+        self.data[start:start + head] = values[:head]
+        self.data[:len(values) - head] = values[head:]
+        self.written += len(values)
+
+    def get(self, start: int, stop: int) -> np.ndarray:
+        """ значения с номерами [start, stop) за всё время; должны ещё оставаться в буфере """
+        if start < self.written - self.capacity or stop > self.written:
+            raise IndexError('Values {}..{} are not in the buffer'.format(start, stop))
+        return self.data[np.arange(start, stop) % self.capacity]
+
+
+class SlidingRange:
+    """
+    Наименьшее и наибольшее из последних window пар (low, high) за O(1) на пару:
+    очереди хранят только значения, которые ещё могут стать экстремумом окна.
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self.count = 0
+        self.lows = deque()
+        self.highs = deque()
+
+    def push(self, low: float, high: float):
+        index = self.count
+        self.count += 1
+        if low == low:
+            while self.lows and self.lows[-1][1] >= low:
+                self.lows.pop()
+            self.lows.append((index, low))
+        if high == high:
+            while self.highs and self.highs[-1][1] <= high:
+                self.highs.pop()
+            self.highs.append((index, high))
+        for extremes in (self.lows, self.highs):
+            while extremes and extremes[0][0] <= index - self.window:
+                extremes.popleft()
+
+    def range(self) -> (float, float):
+        if not self.lows:
+            return None
+        return self.lows[0][1], self.highs[0][1]
+
+
+def drain(source) -> np.ndarray:
+    """
+    Всё, что источник накопил к этому кадру: у очереди (queue.Queue, asyncio.Queue)
+    забираются все элементы, у генератора - следующий блок. Элемент - число или массив.
+    """
+    blocks = []
+    if hasattr(source, 'get_nowait'):
+        while True:
+            try:
+                blocks.append(source.get_nowait())
+            except (queue.Empty, asyncio.QueueEmpty):
+                break
+    else:
+        block = next(source, None)
+        if block is not None:
+            blocks.append(block)
+    if not blocks:
+        return np.empty(0)
+    return np.concatenate([np.atleast_1d(np.asarray(block, dtype=float)).ravel() for block in blocks])
+
+
+def telemetry(rate: int = TELEMETRY_RATE):
+    """ демонстрационный источник: при каждом обращении - отсчёты rate Гц, набежавшие с прошлого раза """
+    started = time.perf_counter()
+    sent = 0
+    rng = np.random.default_rng()
+    while True:
+        due = int((time.perf_counter() - started) * rate)
+        t = np.arange(sent, due) / rate
+        sent = due
+        yield np.sin(2 * np.pi * 0.5 * t) * (2 + np.sin(2 * np.pi * 0.05 * t)) + 0.2 * rng.standard_normal(len(t))
+
+
+class StreamingScaleGraph(IndependentScaleGraph):
+    """
+    Поток отсчётов в масштабе, подобранном по видимым значениям, как у
+    IndependentScaleGraph. Отсчёты из source (см. drain) копятся в RingBuffer
+    на capacity значений; ширина окна - capacity отсчётов, по capacity // width
+    на столбец пикселей. Каждый столбец рисуется вертикальным отрезком от
+    наименьшего до наибольшего значения, размах по y ведёт SlidingRange.
+    Картинка хранится в QPixmap: пока размах не изменился, новые столбцы
+    дорисовываются справа после сдвига картинки, а окно сдвигает уже
+    показанное (QWidget.scroll) и перерисовывает только полосу новых столбцов.
+    """
+
+    def __init__(self, source, capacity: int = STREAM_CAPACITY, fps: int = STREAM_FPS):
+        super().__init__(envelope=True)
+        self.source = source
+        self.ring = RingBuffer(capacity)
+        self.pixmap: QPixmap = None
+        # спаны столбцов, уже посчитанных из отсчётов, и размах, в котором нарисована картинка
+        self.spans: RingBuffer = None
+        self.extremes: SlidingRange = None
+        self.y_range = None
+        self.per_column = 1
+        self.last_value = np.nan
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.tick)
+        self.timer.start(1000 // fps)
+
+    def init_ui(self):
+        super().init_ui()
+        self.setWindowTitle('Function\'s Graphic. Streaming')
+
+    def tick(self):
+        """ приём отсчётов за кадр и дорисовка новых столбцов """
+        values = drain(self.source)
+        if len(values):
+            self.ring.extend(values)
+        if self.pixmap is None or self.pixmap.size() != self.size():
+            self.rebuild()
+        elif self.ring.written // self.per_column > self.spans.written:
+            shift = self.append_columns()
+            if shift is not None:
+                # окно сдвигается вместе с картинкой; перерисовываются только новые столбцы
+                # и стрелка оси у правого края (10 пикселей), которую сдвиг унёс влево
+                self.scroll(-shift, 0)
+                width = min(shift + 11, self.width())
+                self.update(QRect(self.width() - width, 0, width, self.height()))
+                return
+        else:
+            return
+        self.update()
+
+    def column_spans(self, start: int, stop: int) -> np.ndarray:
+        """
+        (low, high) столбцов [start, stop); в столбец входит и последний
+        отсчёт предыдущего, чтобы отрезки смыкались
+        """
+        values = self.ring.get(start * self.per_column, stop * self.per_column).reshape(-1, self.per_column)
+        previous = np.empty(len(values))
+        previous[1:] = values[:-1, -1]
+        previous[:1] = self.last_value
+        self.last_value = values[-1, -1]
+        low = np.fmin(np.fmin.reduce(values, axis=1), previous)
+        high = np.fmax(np.fmax.reduce(values, axis=1), previous)
+        return np.column_stack((low, high))
+
+    def rebuild(self):
+        """ пересчёт столбцов по буферу и полная перерисовка, например после изменения размера окна """
+        columns = max(self.width(), 1)
+        self.per_column = max(self.ring.capacity // columns, 1)
+        self.spans = RingBuffer(columns, (2,))
+        self.extremes = SlidingRange(columns)
+        self.pixmap = QPixmap(self.size())
+
+        complete = self.ring.written // self.per_column
+        oldest = (self.ring.written - self.ring.capacity + self.per_column - 1) // self.per_column
+        first = max(complete - columns, oldest, 0)
+        self.last_value = np.nan
+        self.spans.written = first
+        if complete > first:
+            self.push_spans(self.column_spans(first, complete))
+        self.redraw()
+
+    def append_columns(self) -> int:
+        """ новые столбцы в картинку: число столбцов, на которое она сдвинута, или None после полной перерисовки """
+        old_range = self.y_range
+        complete = self.ring.written // self.per_column
+        start = max(self.spans.written, complete - self.spans.capacity)
+        if start > self.spans.written:
+            self.last_value = np.nan
+            self.spans.written = start
+        self.push_spans(self.column_spans(start, complete))
+        if self.y_range != old_range:
+            self.redraw()
+            return None
+
+        # размах прежний: картинка сдвигается влево, справа рисуются только новые столбцы
+        shift = complete - start
+        self.pixmap.scroll(-shift, 0, self.pixmap.rect())
+        self.draw_columns(complete - shift, complete, clear=True)
+        return shift
+
+    def push_spans(self, spans: np.ndarray):
+        self.spans.extend(spans)
+        for low, high in spans:
+            self.extremes.push(low, high)
+        self.y_range = self.extremes.range()
+        if self.y_range is not None and self.y_range[0] == self.y_range[1]:
+            self.y_range = (self.y_range[0] - 1, self.y_range[1] + 1)
+
+    def redraw(self):
+        self.pixmap.fill(Qt.white)
+        self.draw_columns(max(self.spans.written - self.spans.capacity, 0), self.spans.written)
+
+    def draw_columns(self, start: int, stop: int, clear: bool = False):
+        """ столбцы [start, stop) в картинку; последний столбец окна - у правого края """
+        if self.y_range is None or stop <= start:
+            return
+        max_x, max_y = self.pixmap.width(), self.pixmap.height()
+        left = max_x - (self.spans.written - start)
+        qp = QPainter(self.pixmap)
+        if clear:
+            qp.fillRect(left, 0, stop - start, max_y, Qt.white)
+        y_min, y_max = self.y_range
+        ends = self.spans.get(start, stop)[:, ::-1].ravel()
+        qp.drawLines(polyline(np.repeat(np.arange(left, left + stop - start), 2),
+                              (ends - y_max) * max_y / (y_min - y_max)))
+        qp.end()
+
+    def independent_scale(self, qp):
+        if self.pixmap is None:
+            return
+        qp.drawPixmap(0, 0, self.pixmap)
+        if self.y_range is not None:
+            y_min, y_max = self.y_range
+            qp.drawLines(value_axis(self.width(), (0 - y_max) * self.height() / (y_min - y_max)))
+
+    def wheelEvent(self, e):
+        pass
+
+    def mousePressEvent(self, e):
+        pass
 
 
 def main():
     app = QApplication(sys.argv)
-    independent_scale_graph = IndependentScaleGraph()
+    # python function_graphic.py 'x * sin(x * x)' - график выражения вместо f,
+    # python function_graphic.py --stream - поток отсчётов демонстрационного источника
+    expression = sys.argv[1] if len(sys.argv) > 1 else None
+    if expression == '--stream':
+        independent_scale_graph = StreamingScaleGraph(telemetry())
+    else:
+        independent_scale_graph = IndependentScaleGraph(envelope=True, expression=expression)
     independent_scale_graph.show()
     app.exec_()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
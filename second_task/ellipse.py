@@ -1,56 +1,405 @@
 import sys
 
 from PyQt5.QtWidgets import QWidget, QApplication
-from PyQt5.QtGui import QPainter
-from PyQt5.QtCore import QPoint
+from PyQt5.QtGui import QPainter, QPolygon
 import math
 
+import numpy as np
+
+# точность целых коэффициентов коники: наибольший из A и C - около 2^CONIC_BITS
+CONIC_BITS = 24
+# наименьший радиус кривизны эллипса (в пикселях) для trace_conic и наибольшее измельчение сетки march_conic
+TRACE_RADIUS = 2
+MARCH_SUBDIVISION = 16
+
+
+def ellipse_conic(cx: float, cy: float, rx: float, ry: float, angle: float,
+                  subdivision: int = 1) -> ((int, int), tuple):
+    """
+    Эллипс с центром (cx, cy), полуосями rx, ry и осью rx под углом angle (в радианах)
+    как коника A x^2 + B xy + C y^2 + D x + E y + F = 0 с целыми коэффициентами
+    относительно пикселя (x0, y0), ближайшего к центру; с subdivision координаты
+    - в долях 1 / subdivision пикселя. Внутри эллипса F(x, y) < 0.
+    """
+    x0, y0 = round(cx), round(cy)
+    ox, oy = (cx - x0) * subdivision, (cy - y0) * subdivision
+    cos, sin = math.cos(angle), math.sin(angle)
+    rx_sq, ry_sq = (rx * subdivision) ** 2, (ry * subdivision) ** 2
+    a = ry_sq * cos * cos + rx_sq * sin * sin
+    b = 2 * sin * cos * (ry_sq - rx_sq)
+    c = ry_sq * sin * sin + rx_sq * cos * cos
+    d = -2 * a * ox - b * oy
+    e = -b * ox - 2 * c * oy
+    f = a * ox * ox + b * ox * oy + c * oy * oy - rx_sq * ry_sq
+
+    scale = 2. ** CONIC_BITS / max(a, c)
+    return (x0, y0), tuple(round(k * scale) for k in (a, b, c, d, e, f))
+
+
+def shift(value: int, fx: int, fy: int, coefficients: tuple, step_x: int, step_y: int) -> (int, int, int):
+    """ F и её градиент в соседнем по стороне узле: шаг (step_x, step_y) - единичный вдоль оси """
+    a, b, c = coefficients[:3]
+    if step_x:
+        return value + fx * step_x + a, fx + 2 * a * step_x, fy + b * step_x
+    return value + fy * step_y + c, fx + b * step_y, fy + 2 * c * step_y
+
+
+def quadratic(coefficients: tuple, step_x: int, step_y: int) -> int:
+    """ приращение F без линейной части при шаге (step_x, step_y): A sx^2 + B sx sy + C sy^2 """
+    a, b, c = coefficients[:3]
+    return a * step_x * step_x + b * step_x * step_y + c * step_y * step_y
+
+
+def bilinear(coefficients: tuple, s: (int, int), t: (int, int)) -> int:
+    """ приращение проекции градиента F на t при шаге s """
+    a, b, c = coefficients[:3]
+    return 2 * a * s[0] * t[0] + b * (s[0] * t[1] + s[1] * t[0]) + 2 * c * s[1] * t[1]
+
+
+def trace_conic(coefficients: tuple, start: (int, int), max_steps: int, origin: (int, int) = (0, 0)) -> list:
+    """
+    Обход замкнутой коники с целыми коэффициентами по пикселям, начиная с
+    пикселя start у кривой: каждый шаг - в один из 8 соседних пикселей,
+    поэтому контур без разрывов. Пока касательная (-Fy, Fx) остаётся в
+    одном октанте, шаг - главный (по оси, вдоль которой касательная
+    длиннее) или диагональный, по знаку F в середине между ними; на крутом
+    повороте вместо диагонального может быть поперечный шаг. Как у
+    Брезенхэма, F в середине и проекции градиента на главный и
+    диагональный шаги ведутся сложением целых констант октанта, без
+    умножений и округлений; выход из октанта и возврат к началу проверяются
+    не на каждом шаге, а когда они могут наступить. У центрально-симметричной
+    коники (D = E = 0) обходится половина, вторая получается отражением.
+    Кривизна должна быть много меньше пикселя; для тонких эллипсов -
+    march_conic. Пиксели возвращаются сдвинутыми на origin.
+    """
+    a, b, c, d, e, f = coefficients
+    ox, oy = origin
+    x, y = start[0] + ox, start[1] + oy
+    symmetric = d == 0 and e == 0
+    # обход кончается у start или, для симметричной коники, у отражённого start
+    end_x, end_y = (2 * ox - x, 2 * oy - y) if symmetric else (x, y)
+    points = [(x, y)]
+    steps = 0
+    while steps < max_steps:
+        rx, ry = x - ox, y - oy
+        value = a * rx * rx + b * rx * ry + c * ry * ry + d * rx + e * ry + f
+        fx = 2 * a * rx + b * ry + d
+        fy = b * rx + 2 * c * ry + e
+        # октант: знаки касательной и ось, вдоль которой она длиннее
+        sx, sy = (fy < 0) - (fy > 0), (fx > 0) - (fx < 0)
+        x_major = abs(fy) >= abs(fx)
+        if x_major:
+            main, minor = (sx, 0), (0, sy)
+            minor_outward, main_outward = fy * sy > 0, fx * sx > 0
+            # касательная выходит из октанта, когда turn * gm <= 0 или turn * gs > limit
+            turn, limit = sx * sy, 0
+        else:
+            main, minor = (0, sy), (sx, 0)
+            minor_outward, main_outward = fx * sx > 0, fy * sy > 0
+            turn, limit = -sx * sy, -4
+        moves = (main, (sx, sy), minor)
+        # gm, gs - учетверённые проекции градиента на главный и диагональный шаги; du - 4 F в середине
+        # (x, y) + main + minor / 2, середина (x, y) + main / 2 + minor - со сдвигом v_offset
+        u = (2 * main[0] + minor[0], 2 * main[1] + minor[1])
+        v = (main[0] + 2 * minor[0], main[1] + 2 * minor[1])
+        gm, gs = 4 * (fx * main[0] + fy * main[1]), 4 * (fx * sx + fy * sy)
+        du = 4 * value + (gm + gs) // 2 + quadratic(coefficients, *u)
+        v_offset = quadratic(coefficients, *v) - quadratic(coefficients, *u)
+        (main_x, main_y), (diagonal_x, diagonal_y), (minor_x, minor_y) = moves
+        main_u, diagonal_u, minor_u = (4 * quadratic(coefficients, *step) + 2 * bilinear(coefficients, u, step)
+                                       for step in moves)
+        main_m, diagonal_m, minor_m = (4 * bilinear(coefficients, step, main) for step in moves)
+        main_s, diagonal_s, minor_s = (4 * bilinear(coefficients, step, moves[1]) for step in moves)
+        # за шаг turn * gm падает не больше чем на drop, turn * gs растёт не больше чем на rise
+        drop = max(0, *(-turn * change for change in (main_m, diagonal_m, minor_m)))
+        rise = max(0, *(turn * change for change in (main_s, diagonal_s, minor_s)))
+
+        # выход из октанта, возврат к концу обхода и max_steps проверяются только на шаге check:
+        # раньше ни одно из условий наступить не может
+        check = steps + 1
+        while True:
+            steps += 1
+            if (du < 0) != minor_outward:
+                du += gm + main_u
+                gm += main_m
+                gs += main_s
+                x += main_x
+                y += main_y
+            elif (du + gs // 2 - gm + v_offset < 0) == main_outward:
+                du += gs + diagonal_u
+                gm += diagonal_m
+                gs += diagonal_s
+                x += diagonal_x
+                y += diagonal_y
+            else:
+                du += gs - gm + minor_u
+                gm += minor_m
+                gs += minor_s
+                x += minor_x
+                y += minor_y
+            if steps < check:
+                points.append((x, y))
+                continue
+
+            distance = max(abs(x - end_x), abs(y - end_y))
+            if distance <= 1 and steps > 2:
+                if distance or symmetric:
+                    points.append((x, y))
+                if symmetric:
+                    # отражение половины начинается с end - отражения start; если обход дошёл
+                    # до самого end, end и start в отражении повторяются
+                    half = [(2 * ox - px, 2 * oy - py) for px, py in points]
+                    points.extend(half if distance else half[1:-1])
+                return points
+            points.append((x, y))
+
+            if turn * gm <= 0 or turn * gs > limit or steps >= max_steps:
+                break
+            check = min(steps + (turn * gm - 1) // drop + 1 if drop else max_steps,
+                        steps + (limit - turn * gs) // rise + 1 if rise else max_steps,
+                        max(steps + distance - 1, 3), max_steps)
+    return points
+
+
+def march_conic(coefficients: tuple, start: (int, int), max_steps: int, grid: int = 1) -> list:
+    """
+    Контур выпуклой замкнутой коники с целыми коэффициентами (внутри F < 0),
+    start - целый узел внутри неё. В отличие от trace_conic годится и для
+    очень тонких эллипсов: кривая ведётся от клетки к клетке сетки узлов по
+    знакам F в углах, а на каждом пересечённом ребре берётся ближайший к
+    кривой конец - по знаку F в середине ребра. Соседние пересечённые рёбра
+    лежат в одной клетке, поэтому соседние пиксели контура - соседи по 8
+    направлениям. Неоднозначная клетка (внутри два противоположных угла) для
+    выпуклой фигуры всегда соединяет их. Ребро, которое кривая пересекает
+    дважды (острие тоньше клетки), не видно, поэтому тонкие коники обходят
+    на сетке, мельче пиксельной в grid раз: тогда учитываются только рёбра
+    на линиях пиксельной сетки, а конец ребра округляется до пикселя.
+    """
+    a, b, c, d, e, f = coefficients
+    # p - внутренний, q - внешний конец пересечённого ребра; клетка - слева от направления p -> q
+    px, py = start
+    pv = a * px * px + b * px * py + c * py * py + d * px + e * py + f
+    pfx, pfy = 2 * a * px + b * py + d, b * px + 2 * c * py + e
+    qx, qy, qv, qfx, qfy = px + 1, py, *shift(pv, pfx, pfy, coefficients, 1, 0)
+    while qv < 0:
+        px, py, pv, pfx, pfy = qx, qy, qv, qfx, qfy
+        qx, qv, qfx, qfy = qx + 1, *shift(qv, qfx, qfy, coefficients, 1, 0)
+
+    first = (px, py, qx, qy)
+    mirror = (-px, -py, -qx, -qy) if d == 0 and e == 0 else None
+    points = []
+    for _ in range(max_steps):
+        dx, dy = qx - px, qy - py
+        if dx and py % grid == 0 or dy and px % grid == 0:
+            # 4 F(середины ребра): координаты середины полуцелые, поэтому всё умножено на 4
+            middle = 4 * pv + 2 * (pfx * dx + pfy * dy) + (a if dx else c)
+            x, y = (qx, qy) if middle < 0 else (px, py)
+            point = ((2 * x + grid) // (2 * grid), (2 * y + grid) // (2 * grid))
+            if not points or points[-1] != point:
+                points.append(point)
+
+        # остальные углы клетки: r = q + n, s = p + n, n - нормаль влево от p -> q
+        nx, ny = -dy, dx
+        rv, rfx, rfy = shift(qv, qfx, qfy, coefficients, nx, ny)
+        if rv < 0:
+            px, py, pv, pfx, pfy = qx + nx, qy + ny, rv, rfx, rfy
+        else:
+            sv, sfx, sfy = shift(pv, pfx, pfy, coefficients, nx, ny)
+            if sv < 0:
+                px, py, pv, pfx, pfy = px + nx, py + ny, sv, sfx, sfy
+                qx, qy, qv, qfx, qfy = qx + nx, qy + ny, rv, rfx, rfy
+            else:
+                qx, qy, qv, qfx, qfy = px + nx, py + ny, sv, sfx, sfy
+
+        edge = (px, py, qx, qy)
+        if edge == first:
+            break
+        if edge == mirror:
+            half = [(-x, -y) for x, y in points]
+            points.extend(half[1:] if half[0] == points[-1] else half)
+            break
+    if len(points) > 1 and points[-1] == points[0]:
+        points.pop()
+    return points
+
+
+def line_pixels(x0: int, y0: int, x1: int, y1: int) -> list:
+    """ пиксели отрезка по Брезенхэму """
+    dx, dy = abs(x1 - x0), -abs(y1 - y0)
+    sx, sy = (x0 < x1) - (x0 > x1), (y0 < y1) - (y0 > y1)
+    error = dx + dy
+    points = [(x0, y0)]
+    while (x0, y0) != (x1, y1):
+        double = 2 * error
+        if double >= dy:
+            error += dy
+            x0 += sx
+        if double <= dx:
+            error += dx
+            y0 += sy
+        points.append((x0, y0))
+    return points
+
+
+def rotated_ellipse(cx: float, cy: float, rx: float, ry: float, angle: float) -> list:
+    """
+    Пиксели контура эллипса (см. ellipse_conic) в порядке обхода. Эллипсы,
+    у которых радиус кривизны на концах большой оси (малая^2 / большая)
+    не меньше TRACE_RADIUS, обходит trace_conic, более тонкие - march_conic
+    на сетке, мельче пиксельной (не больше чем в MARCH_SUBDIVISION раз),
+    а эллипсы тоньше пикселя рисуются как их большая ось. Контур точный и
+    без разрывов при любом угле, но построение по шагу на пиксель в Python
+    медленнее векторизованного float_outline (ellipse_benchmark.py).
+    """
+    if rx <= 0 or ry <= 0:
+        raise ValueError('Semi-axes must be positive')
+    major, minor = max(rx, ry), min(rx, ry)
+    # направление большой оси
+    direction = angle if rx >= ry else angle + math.pi / 2
+    cos, sin = math.cos(direction), math.sin(direction)
+    if minor * minor >= TRACE_RADIUS * major:
+        (x0, y0), coefficients = ellipse_conic(cx, cy, rx, ry, angle)
+        # начало - конец малой полуоси, где контур изогнут меньше всего
+        start = (round(cx - x0 - minor * sin), round(cy - y0 + minor * cos))
+        max_steps = 8 * (math.ceil(rx) + math.ceil(ry)) + 16
+        return trace_conic(coefficients, start, max_steps, (x0, y0))
+
+    if 2 * minor >= 1:
+        # острие тоньше клетки сетки march_conic не увидит: сетка мельче в k раз,
+        # чтобы невидимый кончик был короче четверти пикселя
+        k = min(math.ceil(math.sqrt(major / 2) / minor), MARCH_SUBDIVISION)
+        (x0, y0), coefficients = ellipse_conic(cx, cy, rx, ry, angle, k)
+        a, b, c, d, e, f = coefficients
+        # начало обхода - узел внутри эллипса; у тонкого он может найтись только вдали от центра
+        for t in sorted(range(-math.ceil(major * k), math.ceil(major * k) + 1), key=abs):
+            x, y = round((cx - x0) * k + t * cos), round((cy - y0) * k + t * sin)
+            if a * x * x + b * x * y + c * y * y + d * x + e * y + f < 0:
+                max_steps = 8 * k * (math.ceil(rx) + math.ceil(ry)) + 16
+                return [(px + x0, py + y0) for px, py in march_conic(coefficients, (x, y), max_steps, k)]
+
+    return line_pixels(round(cx - major * cos), round(cy - major * sin),
+                       round(cx + major * cos), round(cy + major * sin))
+
+
+def rotate_x(x, y):
+    return x + y
+
+
+def rotate_y(x, y):
+    return -x + y
+
+
+def ellipse_geometry(a, b, c, origin: (int, int) = (150, 350)) -> (float, float, float, float, float):
+    """
+    Центр, полуоси и угол эллипса, который рисует float_outline:
+    rotate_x и rotate_y поворачивают на -45 градусов и растягивают в sqrt(2) раз.
+    """
+    c_sq = c * c
+    a_sq = (a*c_sq + b*c_sq)/(16*a*b*b)
+    b_sq = (a*c_sq + b*c_sq)/(16*a*a*b)
+    dx = c / (4*b)
+    dy = c / (4*a)
+    return (origin[0] + rotate_x(dx, dy), origin[1] + rotate_y(dx, dy),
+            math.sqrt(2 * a_sq), math.sqrt(2 * b_sq), -math.pi / 4)
+
+
+def float_outline(a, b, c, origin: (int, int) = (150, 350)) -> np.ndarray:
+    """
+    Точки прежнего цикла draw_ellipse, массив (n, 2) int32: шаги
+    считаются в дробных числах, а четыре симметричные точки шага
+    поворачиваются и сдвигаются на origin сразу для всех шагов.
+    """
+    c_sq = c * c
+    a_sq = (a*c_sq + b*c_sq)/(16*a*b*b)
+    b_sq = (a*c_sq + b*c_sq)/(16*a*a*b)
+    dx = c / (4*b)
+    dy = c / (4*a)
+    xs, ys = [], []
+    x = 0
+    y = -math.sqrt(b_sq)
+    delta = a_sq + b_sq - 2*a_sq*b
+    while y <= 0:
+        xs.append(x)
+        ys.append(y)
+        if delta < 0:
+            if 2 * (delta - a_sq*y) > a_sq:
+                y += 1
+                delta += a_sq*(2*y + 1)
+            x += 1
+            delta += b_sq*(2*x+1)
+        else:
+            if 2 * (delta - b_sq * x) < b_sq:
+                x += 1
+                delta += b_sq*(2*x + 1)
+            y += 1
+            delta += a_sq * (2 * y + 1)
+
+    x, y = np.array(xs, dtype=float), np.array(ys, dtype=float)
+    local_x = np.column_stack((dx + x, dx + x, dx - x, dx - x)).ravel()
+    local_y = np.column_stack((dy + y, dy - y, dy + y, dy - y)).ravel()
+    # как QPoint из дробных координат - отбрасыванием дробной части
+    return np.column_stack((origin[0] + rotate_x(local_x, local_y),
+                            origin[1] + rotate_y(local_x, local_y))).astype(np.int32)
+
+
+def ellipse_outline(a, b, c, origin: (int, int) = (150, 350), exact: bool = False) -> np.ndarray:
+    """
+    Точки контура эллипса Ellipse(a, b, c) в координатах виджета, массив
+    (n, 2) int32: с exact - целочисленный rotated_ellipse (точный и
+    связный, но медленнее), иначе прежний цикл draw_ellipse (float_outline).
+    """
+    if exact:
+        return np.array(rotated_ellipse(*ellipse_geometry(a, b, c, origin)), dtype=np.int32).reshape(-1, 2)
+    return float_outline(a, b, c, origin)
+
+
+def point_polygon(points: np.ndarray) -> QPolygon:
+    """ QPolygon, заполненный прямо из массива (n, 2) int32, без QPoint на каждую точку """
+    polygon = QPolygon(len(points))
+    if len(points):
+        pointer = polygon.data()
+        pointer.setsize(points.size * np.dtype(np.int32).itemsize)
+        np.frombuffer(pointer, dtype=np.int32).reshape(-1, 2)[:] = points
+    return polygon
+
 
 class Ellipse(QWidget):
-    def __init__(self, a, b, c):
+    def __init__(self, a, b, c, exact=False):
         super().__init__()
         self.init_ui()
         self.a = a
         self.b = b
         self.c = c
+        # exact: рисовать целочисленным обходом коники (rotated_ellipse) вместо прежнего цикла -
+        # ради точного контура без разрывов, а не скорости: построение медленнее
+        self.exact = exact
+        # начало координат эллипса в виджете
+        self.origin = (150, 350)
+        self.cache_key = None
+        self.points = None
+        self.polygon = None
 
     def init_ui(self):
         self.setGeometry(250, 150, 600, 480)
         self.setWindowTitle('Function\'s Graphic. Ellipse')
 
-    def rotate_x(self, x, y):
-        return x + y
-
-    def rotate_y(self, x, y):
-        return -x + y
+    def outline(self) -> np.ndarray:
+        """
+        Точки контура (n, 2) int32 без QPainter. Массив и QPolygon для
+        draw_ellipse строятся заново, только когда меняются a, b, c, exact
+        или origin; массив только для чтения, потому что он общий с кэшем.
+        """
+        key = (self.a, self.b, self.c, self.origin, self.exact)
+        if key != self.cache_key:
+            points = ellipse_outline(*key)
+            points.flags.writeable = False
+            self.points, self.polygon = points, point_polygon(points)
+            self.cache_key = key
+        return self.points
 
     def draw_ellipse(self, qp):
-        a, b, c = self.a, self.b, self.c
-        c_sq = c * c
-        a_sq = (a*c_sq + b*c_sq)/(16*a*b*b)
-        b_sq = (a*c_sq + b*c_sq)/(16*a*a*b)
-        dx = c / (4*b)
-        dy = c / (4*a)
-        x = 0
-        y = -math.sqrt(b_sq)
-        delta = a_sq + b_sq - 2*a_sq*b
-        while y <= 0:
-            qp.drawPoint(QPoint(150 + self.rotate_x(dx + x, dy + y), 350 + self.rotate_y(dx + x, dy + y)))
-            qp.drawPoint(QPoint(150 + self.rotate_x(dx + x, dy - y), 350 + self.rotate_y(dx + x, dy - y)))
-            qp.drawPoint(QPoint(150 + self.rotate_x(dx - x, dy + y), 350 + self.rotate_y(dx - x, dy + y)))
-            qp.drawPoint(QPoint(150 + self.rotate_x(dx - x, dy - y), 350 + self.rotate_y(dx - x, dy - y)))
-            if delta < 0:
-                if 2 * (delta - a_sq*y) > a_sq:
-                    y += 1
-                    delta += a_sq*(2*y + 1)
-                x += 1
-                delta += b_sq*(2*x+1)
-            else:
-                if 2 * (delta - b_sq * x) < b_sq:
-                    x += 1
-                    delta += b_sq*(2*x + 1)
-                y += 1
-                delta += a_sq * (2 * y + 1)
+        self.outline()
+        qp.drawPoints(self.polygon)
 
     def paintEvent(self, e):
         qp = QPainter()
@@ -0,0 +1,126 @@
+"""
+Замер растеризации повёрнутого эллипса.
+
+    python ellipse_benchmark.py
+    python ellipse_benchmark.py -n 20 -c 2000 20000
+
+Сначала проверяет связность контуров rotated_ellipse на случайных эллипсах
+с целым центром (обход половины и отражение) и с дробным. Затем сравнивает
+дробный цикл float_outline (четыре симметричные точки за шаг) с
+целочисленным rotated_ellipse на эллипсах Ellipse(-10, -30, c); у c = 1200
+центр целый. Для каждого варианта печатаются время построения контура,
+число точек, время на точку и наибольший шаг между соседними точками по
+Чебышёву (у прежнего цикла - внутри каждой из четырёх ветвей, у нового - по
+замкнутому контуру): у связного контура он равен 1. Отношение времён больше
+1, если целочисленный вариант быстрее; сейчас он медленнее при всех c и
+выигрывает только точностью и связностью контура. Затем замеряется
+перерисовка точного контура на QImage: drawPoint на каждую точку, один
+drawPoints из готового QPolygon (как в Ellipse.draw_ellipse при попадании
+в кэш) и то же с построением контура (промах кэша).
+"""
+import argparse
+import random
+import timeit
+
+from PyQt5.QtGui import QImage, QPainter
+
+from ellipse import ellipse_geometry, ellipse_outline, float_outline, point_polygon, rotated_ellipse
+
+
+def max_step(chains) -> int:
+    """ наибольший шаг по Чебышёву между соседними точками цепочек """
+    step = 0
+    for chain in chains:
+        for (x0, y0), (x1, y1) in zip(chain, chain[1:]):
+            step = max(step, abs(x1 - x0), abs(y1 - y0))
+    return step
+
+
+def case(name: str, build, chains, number: int) -> dict:
+    seconds = min(timeit.repeat(build, number=number, repeat=5)) / number
+    points = build()
+    return {
+        'variant': name,
+        'ms': seconds * 1e3,
+        'points': len(points),
+        'us_per_point': seconds / len(points) * 1e6,
+        'step': max_step(chains(points)),
+    }
+
+
+def gap_count(count: int, integer_centre: bool, seed: int = 1) -> int:
+    """ сколько из count случайных эллипсов с целым или дробным центром получили контур с разрывом """
+    rng = random.Random(seed)
+    gaps = 0
+    for _ in range(count):
+        major = 10 ** rng.uniform(0.5, 2.7)
+        # эллипс тоньше пикселя рисуется незамкнутым отрезком, поэтому малая полуось - от 0.5
+        minor = max(0.5, major * rng.uniform(0.05, 1))
+        if integer_centre:
+            cx, cy = rng.randint(-50, 50), rng.randint(-50, 50)
+        else:
+            cx, cy = rng.uniform(-50, 50), rng.uniform(-50, 50)
+        points = rotated_ellipse(cx, cy, major, minor, rng.uniform(-4, 4))
+        gaps += max_step([points + points[:1]]) > 1
+    return gaps
+
+
+def paint_case(name: str, paint, number: int) -> dict:
+    """ время перерисовки: paint рисует контур на QImage размером с окно Ellipse """
+    image = QImage(600, 480, QImage.Format_RGB32)
+    painter = QPainter(image)
+    try:
+        seconds = min(timeit.repeat(lambda: paint(painter), number=number, repeat=5)) / number
+    finally:
+        painter.end()
+    return {'variant': name, 'ms': seconds * 1e3}
+
+
+def paint_cases(a, b, c, number: int) -> list:
+    """ перерисовка точного контура: по точке, одним drawPoints из кэша и с построением кэша """
+    points = ellipse_outline(a, b, c, exact=True)
+    pairs = points.tolist()
+    polygon = point_polygon(points)
+
+    def per_point(painter):
+        for x, y in pairs:
+            painter.drawPoint(x, y)
+
+    def uncached(painter):
+        painter.drawPoints(point_polygon(ellipse_outline(a, b, c, exact=True)))
+
+    return [paint_case('drawPoint per point', per_point, number),
+            paint_case('cached drawPoints', lambda painter: painter.drawPoints(polygon), number),
+            paint_case('outline + drawPoints', uncached, number)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the rotated ellipse rasterizers.')
+    parser.add_argument('-n', '--number', type=int, default=10, help='outlines per timing run')
+    parser.add_argument('-c', type=float, nargs='+', default=[1200, 2000, 20000, 200000],
+                        help='c of Ellipse(-10, -30, c); c = 1200 gives an integer centre')
+    parser.add_argument('--check', type=int, default=300, help='random ellipses per connectivity check')
+    args = parser.parse_args(argv)
+
+    for integer_centre in (True, False):
+        print('{} centre: {} of {} random outlines with gaps'.format(
+            'integer' if integer_centre else 'fractional', gap_count(args.check, integer_centre), args.check))
+
+    a, b = -10, -30
+    for c in args.c:
+        geometry = ellipse_geometry(a, b, c)
+        print('c = {:g}: centre ({:g}, {:g}), semi-axes {:.1f} x {:.1f}'.format(c, *geometry[:4]))
+        old = case('float draw_ellipse', lambda: float_outline(a, b, c).tolist(),
+                   lambda points: [points[i::4] for i in range(4)], args.number)
+        new = case('integer rotated_ellipse', lambda: rotated_ellipse(*geometry),
+                   lambda points: [points + points[:1]], args.number)
+        for result in (old, new):
+            print('  {variant:<24} {ms:>9.2f} ms {points:>7} points {us_per_point:>6.2f} us/point  '
+                  'max step {step}'.format(**result))
+        print('  float / integer time {:.2f}x'.format(old['ms'] / new['ms']))
+        for result in paint_cases(a, b, c, args.number):
+            print('  paint, {variant:<21} {ms:>9.2f} ms'.format(**result))
+
+
+if __name__ == '__main__':
+    main()